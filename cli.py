@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Modules that must never be imported just to look at the database
+HEAVY_MODULES = ("torch", "whisper", "openai", "yt_dlp")
+
+# Every subcommand imports what it needs inside its function, so e.g. `view` never pays
+# for torch/Whisper, openai or yt-dlp.
+
+
+def _database(args):
+    from database import Database
+    return Database(args.db)
+
+def cmd_queue(args):
+    """Show the videos waiting to be posted, in posting order"""
+    videos = [video for _, video in _database(args).get_unposted_videos()]
+    videos.sort(key=lambda video: (-(video["priority"] or 0), video["scheduled_at"] or 0, video["created_at"] or 0))
+
+    print(f"\n=== QUEUE ({len(videos)} videos) ===")
+    for video in videos:
+        ready = " ready" if video["prepared_at"] else ""
+        print(f"{video['id']}  [{video['status']}{ready}] priority {video['priority'] or 0}  {video['title']}")
+
+def cmd_view(args):
+    """Show all records in the database"""
+    _database(args).view_records()
+
+def cmd_harvest(args):
+    """Search and download new videos into the queue"""
+    from main import Video, get_successful_person
+
+    successful_person = args.person or get_successful_person()
+    video = Video(successful_person, _database(args), num_videos=args.num)
+    if video.get_videos() is None:
+        return 1
+
+def cmd_post(args):
+    """Post the next queued video (harvesting one if the queue is empty)"""
+    from main import run_once
+
+    if run_once(_database(args)) is None:
+        return 1
+
+def cmd_longform(args):
+    """Turn a long-form video into a thread of snippets"""
+    import yaml
+    from post_long_form_video import run_long_form
+
+    with open(args.config, "r") as f:
+        config = yaml.safe_load(f)
+
+    if not run_long_form(config, _database(args)):
+        return 1
+
+def cmd_daemon(args):
+    """Run the posting daemon (configured in .env)"""
+    from daemon import run_daemon
+    run_daemon(_database(args))
+
+def cmd_prefetch(args):
+    """Prepare videos until the ready-to-post buffer is full"""
+    from prefetch import Prefetcher, prefetch_target
+
+    Prefetcher(_database(args), target=args.target or prefetch_target() or 3).fill()
+
+def cmd_metrics(args):
+    """Show p50/p95 stage timings over the last runs"""
+    from metrics import export_prometheus, print_summary
+
+    db = _database(args)
+    print_summary(db, args.last)
+    if args.export:
+        export_prometheus(db, args.export, args.last)
+
+def cmd_storage(args):
+    """Show storage usage against the quota"""
+    from storage import StorageManager, storage_quota_bytes
+    StorageManager(_database(args), storage_quota_bytes() or 0).report()
+
+def cmd_bench_imports(args):
+    """
+    Time `view` in fresh interpreters and fail if it got slow or pulls in heavy modules.
+
+    Runs against an empty temporary database so only startup and imports are measured.
+    """
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import cli\n"
+        "cli.main(['--db', sys.argv[1], 'view'])\n"
+        "elapsed = time.perf_counter() - start\n"
+        "heavy = [name for name in cli.HEAVY_MODULES if name in sys.modules]\n"
+        "print(json.dumps({'ms': elapsed * 1000, 'heavy': heavy}), file=sys.stderr)\n"
+    )
+
+    timings = []
+    heavy = set()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "bench.sqlite")
+        for _ in range(args.runs):
+            result = subprocess.run(
+                [sys.executable, "-c", code, db_file],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            report = json.loads(result.stderr.strip().splitlines()[-1])
+            timings.append(report["ms"])
+            heavy.update(report["heavy"])
+
+    best = min(timings)
+    print(f"view: best {best:.0f}ms, worst {max(timings):.0f}ms over {args.runs} runs (threshold {args.max_ms:.0f}ms)")
+
+    if heavy:
+        print(f"FAIL: view imports heavy modules: {', '.join(sorted(heavy))}")
+        return 1
+    if best > args.max_ms:
+        print(f"FAIL: view took {best:.0f}ms, over the {args.max_ms:.0f}ms threshold")
+        return 1
+    print("OK")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Daily motivation posting tools")
+    parser.add_argument("--db", help="SQLite database file (default: db.sqlite)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("queue", help=cmd_queue.__doc__).set_defaults(func=cmd_queue)
+    subparsers.add_parser("view", help=cmd_view.__doc__).set_defaults(func=cmd_view)
+
+    harvest = subparsers.add_parser("harvest", help=cmd_harvest.__doc__)
+    harvest.add_argument("--person", help="successful person to search for (default: random from successful.txt)")
+    harvest.add_argument("--num", type=int, default=1, help="number of videos to download")
+    harvest.set_defaults(func=cmd_harvest)
+
+    subparsers.add_parser("post", help=cmd_post.__doc__).set_defaults(func=cmd_post)
+
+    longform = subparsers.add_parser("longform", help=cmd_longform.__doc__)
+    longform.add_argument("--config", default="config.yaml", help="long-form config file")
+    longform.set_defaults(func=cmd_longform)
+
+    subparsers.add_parser("daemon", help=cmd_daemon.__doc__).set_defaults(func=cmd_daemon)
+
+    prefetch = subparsers.add_parser("prefetch", help=cmd_prefetch.__doc__)
+    prefetch.add_argument("--target", type=int, help="number of ready-to-post videos to keep (default: PREFETCH_TARGET or 3)")
+    prefetch.set_defaults(func=cmd_prefetch)
+
+    metrics = subparsers.add_parser("metrics", help=cmd_metrics.__doc__)
+    metrics.add_argument("--last", type=int, default=20, help="number of most recent runs to summarize")
+    metrics.add_argument("--export", help="also write a Prometheus textfile to this path")
+    metrics.set_defaults(func=cmd_metrics)
+
+    subparsers.add_parser("storage", help=cmd_storage.__doc__).set_defaults(func=cmd_storage)
+
+    bench = subparsers.add_parser("bench-imports", help="fail if `view` starts slower than a threshold")
+    bench.add_argument("--max-ms", type=float, default=300, help="threshold for the best run in milliseconds")
+    bench.add_argument("--runs", type=int, default=5, help="number of fresh interpreter runs")
+    bench.set_defaults(func=cmd_bench_imports)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import datetime
+import json
+import os
+import random
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+from database import Database
+from main import run_once
+from poster import XPoster, shared_rate_limiter
+from prefetch import Prefetcher, prefetch_target
+
+load_dotenv()
+
+
+def parse_quiet_hours(value):
+    """Parse "22-7" into (22, 7): no posting from 22:00 until 07:00 local time"""
+    if not value:
+        return None
+    start, end = value.split("-")
+    return int(start) % 24, int(end) % 24
+
+
+class PostingDaemon:
+    """
+    Long-running poster that keeps the Database connection, XPoster (with its keep-alive
+    X API session and loaded Whisper model) and rate-limit budgets warm between posts.
+
+    A video is posted every interval_secs, shifted by up to jitter_secs either way and
+    pushed out of quiet hours. A failed post is retried after retry_secs. SIGTERM and
+    SIGINT stop the daemon once the current post is finished, and a small health
+    endpoint reports its state on localhost. With a Prefetcher, ready-to-post videos are
+    prepared in the background between posts.
+    """
+
+    def __init__(self, db, xposter, interval_secs=24 * 60 * 60, jitter_secs=0, quiet_hours=None,
+                 retry_secs=15 * 60, health_port=None, prefetcher=None):
+        self.db = db
+        self.xposter = xposter
+        self.prefetcher = prefetcher
+        self.interval_secs = interval_secs
+        self.jitter_secs = jitter_secs
+        self.quiet_hours = quiet_hours
+        self.retry_secs = retry_secs
+        self.health_port = health_port
+
+        self._stop = threading.Event()
+        self._server = None
+        self.started_at = time.time()
+        self.next_post_at = None
+        self.last_post_at = None
+        self.last_post_id = None
+        self.last_error = None
+        self.posts = 0
+        self.failures = 0
+
+    def in_quiet_hours(self, timestamp):
+        if not self.quiet_hours:
+            return False
+        start, end = self.quiet_hours
+        hour = datetime.datetime.fromtimestamp(timestamp).hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def schedule(self, delay_secs, jitter=True):
+        """Set the next post time delay_secs from now, with jitter, outside quiet hours"""
+        next_post_at = time.time() + delay_secs
+        if jitter and self.jitter_secs:
+            next_post_at += random.uniform(-self.jitter_secs, self.jitter_secs)
+
+        # move past quiet hours in 10 minute steps
+        while self.in_quiet_hours(next_post_at):
+            next_post_at += 10 * 60
+
+        self.next_post_at = max(next_post_at, time.time())
+        print(f"⏰ Next post at {datetime.datetime.fromtimestamp(self.next_post_at):%Y-%m-%d %H:%M:%S}")
+
+    def stop(self, *_):
+        """Stop after the current post (also the SIGTERM/SIGINT handler)"""
+        if not self._stop.is_set():
+            print("🛑 Shutting down after the current post...")
+        self._stop.set()
+
+    def health(self):
+        """Current state, as served by the health endpoint"""
+        return {
+            "status": "ok" if self.last_error is None else "degraded",
+            "uptime_secs": round(time.time() - self.started_at),
+            "next_post_at": self.next_post_at,
+            "last_post_at": self.last_post_at,
+            "last_post_id": self.last_post_id,
+            "last_error": self.last_error,
+            "posts": self.posts,
+            "failures": self.failures,
+            "prepared_videos": self.db.count_prepared(),
+            "rate_limits": shared_rate_limiter.state(),
+        }
+
+    def _start_health_server(self):
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/health"):
+                    self.send_error(404)
+                    return
+                body = json.dumps(daemon.health()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.health_port), HealthHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"Health endpoint on http://127.0.0.1:{self.health_port}/health")
+
+    def run_post(self):
+        """Post one video now and schedule the next one"""
+        try:
+            post_id = run_once(self.db, xposter=self.xposter)
+        except Exception as e:
+            print(f"ERROR: Post failed: {e}")
+            self.last_error = str(e)
+            self.failures += 1
+            self.schedule(self.retry_secs, jitter=False)
+            return
+
+        if post_id is None:
+            self.last_error = "No video could be found"
+            self.failures += 1
+            self.schedule(self.retry_secs, jitter=False)
+            return
+
+        self.last_error = None
+        self.last_post_at = time.time()
+        self.last_post_id = post_id
+        self.posts += 1
+        self.schedule(self.interval_secs)
+
+    def run(self):
+        """Post on schedule until stopped"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if self.health_port:
+            self._start_health_server()
+        if self.prefetcher:
+            self.prefetcher.start()
+
+        # pick up the cadence from the last post, so a restart doesn't post early
+        last_posted_at = self.db.get_last_posted_at()
+        self.schedule(max(0, last_posted_at + self.interval_secs - time.time()) if last_posted_at else 0)
+        try:
+            while not self._stop.is_set():
+                if self._stop.wait(max(0, self.next_post_at - time.time())):
+                    break
+                self.run_post()
+        finally:
+            if self.prefetcher:
+                self.prefetcher.stop()
+            if self._server:
+                self._server.shutdown()
+            self.db.close()
+            print("Daemon stopped")
+
+
+def run_daemon(db=None):
+    """Run the posting daemon with the DAEMON_* settings from the environment"""
+    db = db or Database()
+    xposter = XPoster(db=db)
+
+    # keep videos prepared in the background, sharing the loaded Whisper model
+    prefetcher = None
+    if prefetch_target():
+        prefetcher = Prefetcher(db, target=prefetch_target(), post_generator=xposter.post_generator)
+
+    daemon = PostingDaemon(
+        db,
+        xposter,
+        interval_secs=float(os.getenv("DAEMON_INTERVAL_HOURS", "24")) * 60 * 60,
+        jitter_secs=float(os.getenv("DAEMON_JITTER_MINUTES", "30")) * 60,
+        quiet_hours=parse_quiet_hours(os.getenv("DAEMON_QUIET_HOURS")),
+        retry_secs=float(os.getenv("DAEMON_RETRY_MINUTES", "15")) * 60,
+        health_port=int(os.getenv("DAEMON_HEALTH_PORT", "8080")) or None,
+        prefetcher=prefetcher,
+    )
+    daemon.run()
+
+
+if __name__ == "__main__":
+    run_daemon()
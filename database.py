@@ -0,0 +1,656 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+# Hot columns of the videos table returned by lookups
+VIDEO_COLUMNS = (
+    "id, title, webpage_url, filepath, successful_person, post_id, x_media_id, x_media_expires_at, "
+    "status, duration, created_at, posted_at, priority, scheduled_at, claimed_by, lease_expires_at, "
+    "caption, prepared_at"
+)
+
+def _compress(data):
+    return zlib.compress(json.dumps(data).encode("utf-8"))
+
+def _decompress(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class Database:
+    def __init__(self, source_file=None):
+        self.db_file = source_file or "db.sqlite"
+
+        # One long-lived connection shared by all methods (and threads, serialized by the lock)
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.conn.execute('PRAGMA cache_size = -16000')  # 16MB page cache
+        self.conn.execute('PRAGMA mmap_size = 67108864')  # 64MB
+        self.conn.execute('PRAGMA busy_timeout = 30000')
+
+        self.init_db()
+
+    @contextmanager
+    def _transaction(self):
+        """Run statements on the shared connection and commit them together"""
+        with self._lock:
+            try:
+                yield self.conn
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """Close the shared connection"""
+        with self._lock:
+            self.conn.close()
+
+    def init_db(self):
+        """Initialize the SQLite database and create tables if they don't exist"""
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS videos (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    webpage_url TEXT,
+                    filepath TEXT,
+                    successful_person TEXT,
+                    post_id TEXT,
+                    x_media_id TEXT,
+                    x_media_expires_at REAL,  -- when the uploaded media id stops being usable
+                    data TEXT,  -- legacy JSON blob, migrated to video_info
+                    status TEXT DEFAULT 'queued',  -- queued, claimed or posted
+                    duration REAL,
+                    created_at REAL,
+                    posted_at REAL,
+                    priority INTEGER DEFAULT 0,  -- higher is posted first
+                    scheduled_at REAL,  -- not posted before this time
+                    claimed_by TEXT,
+                    lease_expires_at REAL,
+                    caption TEXT,  -- generated post text, stored by the prefetcher
+                    prepared_at REAL,  -- when the video was made ready to post
+                    prepare_attempts INTEGER DEFAULT 0  -- failed attempts to prepare it
+                )
+            ''')
+            # Full yt-dlp info dicts, zlib-compressed JSON, only loaded on demand
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS video_info (
+                    id TEXT PRIMARY KEY,
+                    data BLOB
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    successful_person TEXT,
+                    query TEXT,
+                    results TEXT,  -- JSON list of flat search entries
+                    complete INTEGER,  -- 1 if the search was read to the end
+                    fetched_at REAL,
+                    PRIMARY KEY (successful_person, query)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    key TEXT PRIMARY KEY,  -- video id, or any caller-chosen download key
+                    url TEXT,
+                    status TEXT,  -- downloading, complete or failed
+                    filepath TEXT,
+                    size INTEGER,
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL
+                )
+            ''')
+
+            # Cached outputs of pipeline stages, zlib-compressed JSON
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    stage TEXT,
+                    key TEXT,  -- hash of the stage version and its inputs
+                    data BLOB,
+                    created_at REAL,
+                    PRIMARY KEY (stage, key)
+                )
+            ''')
+
+            # Progress of long-form threads, one row per tweet, so a failed run can resume
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS thread_posts (
+                    thread_key TEXT,  -- the source video url
+                    position INTEGER,  -- order in the thread
+                    file TEXT,
+                    snippet_hash TEXT,  -- identifies the snippet (or source reply) posted here
+                    media_id TEXT,
+                    media_expires_at REAL,
+                    tweet_id TEXT,
+                    parent_id TEXT,  -- tweet this one replies to
+                    updated_at REAL,
+                    PRIMARY KEY (thread_key, position)
+                )
+            ''')
+
+            # Pipeline runs and the timing spans of their stages (see metrics.py)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT,  -- post or longform
+                    status TEXT,  -- running, ok or error
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS run_stages (
+                    run_id INTEGER,
+                    stage TEXT,
+                    status TEXT,  -- ok or error
+                    started_at REAL,
+                    wall_secs REAL,
+                    cpu_secs REAL,
+                    peak_rss_kb INTEGER,
+                    bytes INTEGER
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_run_stages_run ON run_stages (run_id)')
+
+            self._migrate_videos(conn)
+
+            thread_post_columns = {row["name"] for row in conn.execute('PRAGMA table_info(thread_posts)')}
+            if "snippet_hash" not in thread_post_columns:
+                conn.execute('ALTER TABLE thread_posts ADD COLUMN snippet_hash TEXT')
+
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_status ON videos (status, lease_expires_at)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_videos_queue ON videos (status, priority DESC, scheduled_at, created_at)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_person ON videos (successful_person)')
+            # MAX(posted_at) for the daemon's cadence, and duration filters over the queue
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_posted_at ON videos (posted_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_duration ON videos (duration)')
+
+    def _migrate_videos(self, conn):
+        """Add the hot columns to older databases and move their JSON blobs to video_info"""
+        columns = {row["name"] for row in conn.execute('PRAGMA table_info(videos)')}
+        for column, column_type in (
+            ("status", "TEXT DEFAULT 'queued'"),
+            ("duration", "REAL"),
+            ("created_at", "REAL"),
+            ("posted_at", "REAL"),
+            ("priority", "INTEGER DEFAULT 0"),
+            ("scheduled_at", "REAL"),
+            ("claimed_by", "TEXT"),
+            ("lease_expires_at", "REAL"),
+            ("x_media_expires_at", "REAL"),
+            ("caption", "TEXT"),
+            ("prepared_at", "REAL"),
+            ("prepare_attempts", "INTEGER DEFAULT 0"),
+        ):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE videos ADD COLUMN {column} {column_type}')
+
+        rows = conn.execute('SELECT id, post_id, data FROM videos WHERE data IS NOT NULL').fetchall()
+        for row in rows:
+            info = json.loads(row["data"])
+            conn.execute(
+                'INSERT OR REPLACE INTO video_info (id, data) VALUES (?, ?)',
+                (row["id"], _compress(info))
+            )
+            conn.execute('''
+                UPDATE videos
+                SET status = ?, duration = ?, created_at = COALESCE(created_at, ?), data = NULL
+                WHERE id = ?
+            ''', ("posted" if row["post_id"] else "queued", info.get("duration"), time.time(), row["id"]))
+
+        if rows:
+            print(f"Migrated {len(rows)} videos to the slim schema")
+
+        # older versions stored unposted videos with post_id = '', which counts as posted now
+        conn.execute('''
+            UPDATE videos
+            SET post_id = NULL, status = CASE WHEN status = 'posted' THEN 'queued' ELSE status END
+            WHERE post_id = ''
+        ''')
+
+    def add_video(self, video):
+        """Add a video to the database"""
+        self.add_videos([video])
+
+    def add_videos(self, videos):
+        """
+        Add or update many videos in a single transaction.
+
+        Existing rows are upserted: their metadata is refreshed, but an existing
+        post_id, x_media_id, queue state and created_at are never overwritten. A video added
+        with a post_id counts as posted now, unless it already has a posted_at. Stored
+        video info is only replaced by a full yt-dlp extraction (one with formats), never
+        by a flat search entry.
+        """
+        now = time.time()
+        rows = []
+        infos = []
+        for video in videos:
+            post_id = video.get("post_id") or None
+            rows.append((
+                video["id"],
+                video.get("title"),
+                video.get("webpage_url"),
+                video.get("filepath"),
+                video.get("successful_person"),
+                post_id,
+                "posted" if post_id else "queued",
+                video.get("duration"),
+                now,
+                now if post_id else None,
+                video.get("priority", 0),
+                video.get("scheduled_at"),
+            ))
+            # Store complete video data, compressed
+            infos.append((video["id"], _compress(video), "formats" in video))
+
+        with self._transaction() as conn:
+            conn.executemany('''
+                INSERT INTO videos
+                (id, title, webpage_url, filepath, successful_person, post_id, status, duration, created_at,
+                 posted_at, priority, scheduled_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    title = COALESCE(excluded.title, videos.title),
+                    webpage_url = COALESCE(excluded.webpage_url, videos.webpage_url),
+                    filepath = COALESCE(excluded.filepath, videos.filepath),
+                    successful_person = COALESCE(excluded.successful_person, videos.successful_person),
+                    duration = COALESCE(excluded.duration, videos.duration),
+                    post_id = COALESCE(videos.post_id, excluded.post_id),
+                    status = CASE
+                        WHEN COALESCE(videos.post_id, excluded.post_id) IS NOT NULL THEN 'posted'
+                        ELSE videos.status
+                    END,
+                    posted_at = CASE
+                        WHEN COALESCE(videos.post_id, excluded.post_id) IS NOT NULL
+                            THEN COALESCE(videos.posted_at, excluded.created_at)
+                        ELSE videos.posted_at
+                    END
+            ''', rows)
+            conn.executemany('''
+                INSERT INTO video_info (id, data) VALUES (?, ?)
+                ON CONFLICT(id) DO UPDATE SET data = excluded.data WHERE ?
+            ''', infos)
+
+        return len(rows)
+
+    def update_video(self, video_id, post_id):
+        """Update a video's post_id and mark it as posted"""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE videos SET post_id = ?, status = ?, posted_at = ? WHERE id = ?',
+                (post_id, "posted", time.time(), video_id)
+            )
+
+    def update_video_media_id(self, video_id, media_id, expires_at=None):
+        """Update a video's x_media_id and when it expires (None clears both)"""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE videos SET x_media_id = ?, x_media_expires_at = ? WHERE id = ?',
+                (media_id, expires_at, video_id)
+            )
+
+    def clear_video_filepath(self, video_id):
+        """Forget a video's file after it was removed from disk"""
+        with self._transaction() as conn:
+            conn.execute('UPDATE videos SET filepath = NULL WHERE id = ?', (video_id,))
+
+    def claim_next(self, worker_id, lease_secs=3600):
+        """
+        Atomically claim the next video to post, or return None if the queue is empty.
+
+        The highest-priority queued video whose scheduled_at has passed is marked as
+        claimed by worker_id for lease_secs. Claims whose lease expired (e.g. the worker
+        died) are returned to the queue first, so another worker can pick them up.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('''
+                UPDATE videos
+                SET status = 'queued', claimed_by = NULL, lease_expires_at = NULL
+                WHERE status = 'claimed' AND lease_expires_at < ?
+            ''', (now,))
+            row = conn.execute(f'''
+                UPDATE videos
+                SET status = 'claimed', claimed_by = ?, lease_expires_at = ?
+                WHERE id = (
+                    SELECT id FROM videos
+                    WHERE status = 'queued' AND (scheduled_at IS NULL OR scheduled_at <= ?)
+                    ORDER BY priority DESC, scheduled_at, created_at
+                    LIMIT 1
+                )
+                RETURNING {VIDEO_COLUMNS}
+            ''', (worker_id, now + lease_secs, now)).fetchone()
+
+        return dict(row) if row else None
+
+    def renew_lease(self, video_id, worker_id, lease_secs=3600):
+        """Extend worker_id's claim on a video by lease_secs from now; returns False if it no longer holds it"""
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE videos
+                SET lease_expires_at = ?
+                WHERE id = ? AND status = 'claimed' AND claimed_by = ?
+            ''', (time.time() + lease_secs, video_id, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, video_id, worker_id, post_id):
+        """Mark a claimed video as posted; returns False if worker_id no longer holds the claim"""
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE videos
+                SET status = 'posted', post_id = ?, posted_at = ?, claimed_by = NULL, lease_expires_at = NULL
+                WHERE id = ? AND claimed_by = ?
+            ''', (post_id, time.time(), video_id, worker_id))
+            return cursor.rowcount == 1
+
+    def release(self, video_id, worker_id, delay_secs=0):
+        """Return a claimed video to the queue, optionally not to be retried for delay_secs"""
+        with self._transaction() as conn:
+            cursor = conn.execute('''
+                UPDATE videos
+                SET status = 'queued', claimed_by = NULL, lease_expires_at = NULL,
+                    scheduled_at = CASE WHEN ? > 0 THEN ? ELSE scheduled_at END
+                WHERE id = ? AND claimed_by = ?
+            ''', (delay_secs, time.time() + delay_secs, video_id, worker_id))
+            return cursor.rowcount == 1
+
+    def get_videos_to_prepare(self, limit=1, max_attempts=3):
+        """
+        Get downloaded, queued videos that haven't been prepared for posting yet, in posting order.
+
+        Videos that failed to prepare max_attempts times are left out; they are still posted,
+        just without a prepared encode and caption.
+        """
+        rows = self._query(f'''
+            SELECT {VIDEO_COLUMNS} FROM videos
+            WHERE status = 'queued' AND prepared_at IS NULL AND filepath IS NOT NULL
+                AND COALESCE(prepare_attempts, 0) < ?
+            ORDER BY priority DESC, scheduled_at, created_at
+            LIMIT ?
+        ''', (max_attempts, limit))
+        return [dict(row) for row in rows]
+
+    def record_prepare_failure(self, video_id):
+        """Count a failed attempt to prepare a video"""
+        with self._transaction() as conn:
+            conn.execute(
+                'UPDATE videos SET prepare_attempts = COALESCE(prepare_attempts, 0) + 1 WHERE id = ?',
+                (video_id,)
+            )
+
+    def count_prepared(self):
+        """Number of queued videos that are ready to post"""
+        return self._query(
+            "SELECT COUNT(*) FROM videos WHERE status = 'queued' AND prepared_at IS NOT NULL"
+        )[0][0]
+
+    def count_queued_by_person(self):
+        """Number of unposted videos per successful person"""
+        rows = self._query(
+            "SELECT successful_person, COUNT(*) FROM videos WHERE status != 'posted' GROUP BY successful_person"
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def set_video_caption(self, video_id, caption, priority_boost=1):
+        """Store a prepared video's caption and move it up the queue, so ready videos are posted first"""
+        with self._transaction() as conn:
+            conn.execute('''
+                UPDATE videos
+                SET caption = ?, prepared_at = ?, priority = COALESCE(priority, 0) + ?
+                WHERE id = ? AND prepared_at IS NULL
+            ''', (caption, time.time(), priority_boost, video_id))
+
+    def get_posted_video_files(self):
+        """Get (id, filepath) of posted videos that still have a file recorded"""
+        return self._query(
+            'SELECT id, filepath FROM videos WHERE status = ? AND filepath IS NOT NULL', ("posted",)
+        )
+
+    def get_in_use_video_files(self):
+        """Get the filepaths of videos whose upload encode is in use: claimed ones and prepared, queued ones"""
+        rows = self._query('''
+            SELECT filepath FROM videos
+            WHERE filepath IS NOT NULL
+                AND (status = 'claimed' OR (status = 'queued' AND prepared_at IS NOT NULL))
+        ''')
+        return [row["filepath"] for row in rows]
+
+    def get_posted_snippet_files(self):
+        """Get the snippet files whose every recorded thread position has been tweeted"""
+        rows = self._query('''
+            SELECT file FROM thread_posts
+            WHERE file IS NOT NULL
+            GROUP BY file
+            HAVING COUNT(tweet_id) = COUNT(*)
+        ''')
+        return [row["file"] for row in rows]
+
+    def get_posted_thread_keys(self):
+        """Get the keys (source video urls) of threads whose every recorded tweet has been posted"""
+        rows = self._query('''
+            SELECT thread_key FROM thread_posts
+            GROUP BY thread_key
+            HAVING COUNT(tweet_id) = COUNT(*)
+        ''')
+        return [row["thread_key"] for row in rows]
+
+    def get_unposted_videos(self):
+        """Get videos that haven't been posted yet"""
+        rows = self._query(f'SELECT {VIDEO_COLUMNS} FROM videos WHERE status != ?', ("posted",))
+        return [(row["id"], dict(row)) for row in rows]
+
+    def get_last_posted_at(self):
+        """When the most recent video was posted, or None if nothing has been posted"""
+        return self._query('SELECT MAX(posted_at) FROM videos')[0][0]
+
+    def has_video(self, video_id):
+        """Check whether a video is in the database (primary key lookup)"""
+        return bool(self._query('SELECT 1 FROM videos WHERE id = ?', (video_id,)))
+
+    def get_video(self, video_id):
+        """Get a single video's columns, or None if it isn't in the database"""
+        rows = self._query(f'SELECT {VIDEO_COLUMNS} FROM videos WHERE id = ?', (video_id,))
+        return dict(rows[0]) if rows else None
+
+    def get_videos(self, video_ids):
+        """Get the columns of the given videos as a dict keyed by id; unknown ids are left out"""
+        video_ids = list(video_ids)
+        videos_dict = {}
+
+        # stay well under SQLite's bound-parameter limit
+        for i in range(0, len(video_ids), 500):
+            batch = video_ids[i:i + 500]
+            rows = self._query(
+                f'SELECT {VIDEO_COLUMNS} FROM videos WHERE id IN ({",".join("?" * len(batch))})',
+                batch
+            )
+            videos_dict.update((row["id"], dict(row)) for row in rows)
+
+        return videos_dict
+
+    def get_video_info(self, video_id):
+        """Get the full stored yt-dlp info dict of a video, or None"""
+        rows = self._query('SELECT data FROM video_info WHERE id = ?', (video_id,))
+        return _decompress(rows[0][0]) if rows else None
+
+    @property
+    def videos(self):
+        """
+        Provide backward compatibility by simulating the old videos dict.
+
+        This loads and decompresses every row; use has_video / get_video / get_videos for lookups.
+        """
+        rows = self._query(f'''
+            SELECT {VIDEO_COLUMNS}, (SELECT data FROM video_info WHERE video_info.id = videos.id) AS info
+            FROM videos
+        ''')
+        videos_dict = {}
+        for row in rows:
+            video = dict(row)
+            info = video.pop("info")
+            videos_dict[row["id"]] = {**(_decompress(info) if info else {}), **video}
+        return videos_dict
+
+    def get_video_media_id(self, video_id, min_remaining_secs=600):
+        """
+        Get the cached media_id for a video, or None if there is none or it is about to expire.
+
+        Media ids without a recorded expiry are never reused.
+        """
+        rows = self._query(
+            'SELECT x_media_id FROM videos WHERE id = ? AND x_media_id IS NOT NULL AND x_media_expires_at > ?',
+            (video_id, time.time() + min_remaining_secs)
+        )
+        return rows[0][0] if rows else None
+
+    def get_search_results(self, successful_person, query, ttl):
+        """Get cached search results as (entries, complete), or None if missing or older than ttl seconds"""
+        rows = self._query(
+            'SELECT results, complete FROM search_cache WHERE successful_person = ? AND query = ? AND fetched_at > ?',
+            (successful_person, query, time.time() - ttl)
+        )
+        return (json.loads(rows[0][0]), bool(rows[0][1])) if rows else None
+
+    def save_search_results(self, successful_person, query, entries, complete):
+        """Cache the search results for a person"""
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO search_cache
+                (successful_person, query, results, complete, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (successful_person, query, json.dumps(entries), int(complete), time.time()))
+
+    def get_download_state(self, key):
+        """Get the recorded state of a download, or None if it was never attempted"""
+        rows = self._query('SELECT * FROM downloads WHERE key = ?', (key,))
+        return dict(rows[0]) if rows else None
+
+    def set_download_state(self, key, url, status, filepath=None, size=None, error=None):
+        """Record the state of a download; starting a download counts as a new attempt"""
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT INTO downloads (key, url, status, filepath, size, attempts, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    url = excluded.url,
+                    status = excluded.status,
+                    filepath = COALESCE(excluded.filepath, downloads.filepath),
+                    size = COALESCE(excluded.size, downloads.size),
+                    attempts = downloads.attempts + excluded.attempts,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+            ''', (key, url, status, filepath, size, int(status == "downloading"), error, time.time()))
+
+    def get_artifact(self, stage, key):
+        """Get a stored stage artifact, or None if the stage hasn't run for these inputs"""
+        rows = self._query('SELECT data FROM artifacts WHERE stage = ? AND key = ?', (stage, key))
+        return _decompress(rows[0][0]) if rows else None
+
+    def put_artifact(self, stage, key, data):
+        """Store a stage artifact"""
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO artifacts (stage, key, data, created_at) VALUES (?, ?, ?, ?)',
+                (stage, key, _compress(data), time.time())
+            )
+
+    def get_thread_posts(self, thread_key):
+        """Get the recorded progress of a thread as {position: row}"""
+        rows = self._query('SELECT * FROM thread_posts WHERE thread_key = ?', (thread_key,))
+        return {row["position"]: dict(row) for row in rows}
+
+    def save_thread_post(self, thread_key, position, file=None, media_id=None, media_expires_at=None,
+                         tweet_id=None, parent_id=None, snippet_hash=None):
+        """Record progress of one tweet of a thread; fields left as None keep their stored value"""
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT INTO thread_posts
+                (thread_key, position, file, media_id, media_expires_at, tweet_id, parent_id, updated_at,
+                 snippet_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(thread_key, position) DO UPDATE SET
+                    file = COALESCE(excluded.file, thread_posts.file),
+                    snippet_hash = COALESCE(excluded.snippet_hash, thread_posts.snippet_hash),
+                    media_id = COALESCE(excluded.media_id, thread_posts.media_id),
+                    media_expires_at = COALESCE(excluded.media_expires_at, thread_posts.media_expires_at),
+                    tweet_id = COALESCE(excluded.tweet_id, thread_posts.tweet_id),
+                    parent_id = COALESCE(excluded.parent_id, thread_posts.parent_id),
+                    updated_at = excluded.updated_at
+            ''', (thread_key, position, file, media_id, media_expires_at, tweet_id, parent_id, time.time(), snippet_hash))
+
+    def clear_thread_posts(self, thread_key):
+        """Forget the progress of a thread, so it is posted from scratch"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM thread_posts WHERE thread_key = ?', (thread_key,))
+
+    def start_run(self, kind):
+        """Record the start of a pipeline run and return its id"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO runs (kind, status, started_at) VALUES (?, ?, ?)', (kind, "running", time.time())
+            )
+            return cursor.lastrowid
+
+    def finish_run(self, run_id, status):
+        """Record the end of a pipeline run"""
+        with self._transaction() as conn:
+            conn.execute('UPDATE runs SET status = ?, finished_at = ? WHERE id = ?', (status, time.time(), run_id))
+
+    def record_stage(self, run_id, stage, started_at, wall_secs, cpu_secs, peak_rss_kb, bytes_processed, status):
+        """Record the timing span of one stage of a run"""
+        with self._transaction() as conn:
+            conn.execute('''
+                INSERT INTO run_stages (run_id, stage, status, started_at, wall_secs, cpu_secs, peak_rss_kb, bytes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (run_id, stage, status, started_at, wall_secs, cpu_secs, peak_rss_kb, bytes_processed))
+
+    def get_stage_timings(self, last_runs=20):
+        """Get the stage spans of the last runs, oldest first"""
+        return self._query('''
+            SELECT run_stages.*, runs.kind
+            FROM run_stages JOIN runs ON runs.id = run_stages.run_id
+            WHERE run_stages.run_id IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?)
+            ORDER BY run_stages.run_id, run_stages.started_at
+        ''', (last_runs,))
+
+    def delete_video(self, video_id):
+        """Delete a video from the database"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM videos WHERE id = ?', (video_id,))
+            conn.execute('DELETE FROM video_info WHERE id = ?', (video_id,))
+        print(f"Deleted video {video_id} from database")
+
+    def view_records(self):
+        """View all records in the database in a formatted way"""
+        rows = self._query('''
+            SELECT id, title, successful_person, post_id
+            FROM videos
+            ORDER BY id
+        ''')
+
+        print("\n=== DATABASE RECORDS ===")
+        for row in rows:
+            video_id, title, successful_person, post_id = row
+            status = "POSTED" if post_id else "UNPOSTED"
+            print(f"ID: {video_id}")
+            print(f"Title: {title}")
+            print(f"Person: {successful_person}")
+            print(f"Status: {status}")
+            if post_id:
+                print(f"Post ID: {post_id}")
+            print("-" * 50)
@@ -0,0 +1,110 @@
+import os
+import shutil
+import subprocess
+import yt_dlp
+
+from media import probe_media
+
+
+class DownloadManager:
+    """
+    Resumable, parallel yt-dlp downloads with verification and state tracking.
+
+    Downloads keep their .part files and continue them on the next attempt. Fragmented
+    (DASH/HLS) formats are fetched with concurrent fragment downloads, and plain HTTP
+    formats are split across parallel connections with aria2c when it is installed.
+    Every finished file is verified (non-empty, readable by ffprobe, expected duration)
+    before it is reported as complete. When a Database is given, each download's state
+    (attempts, status, final path, size, last error) is recorded under a caller-chosen
+    key, so a retry after an interrupted run reuses a verified file instead of
+    starting over.
+    """
+
+    def __init__(self, db=None, concurrent_fragments=8, connections=8, retries=10):
+        self.db = db
+        self.concurrent_fragments = concurrent_fragments
+        self.connections = connections
+        self.retries = retries
+
+    def _ydl_opts(self, ydl_opts):
+        opts = {
+            'continuedl': True,
+            'nopart': False,
+            'retries': self.retries,
+            'fragment_retries': self.retries,
+            'concurrent_fragment_downloads': self.concurrent_fragments,
+        }
+
+        if shutil.which('aria2c'):
+            opts['external_downloader'] = {'http': 'aria2c'}
+            opts['external_downloader_args'] = {
+                'aria2c': ['-c', '-x', str(self.connections), '-s', str(self.connections), '-k', '1M']
+            }
+
+        opts.update(ydl_opts)
+        return opts
+
+    def verify(self, filepath, expected_duration=None):
+        """Check that a downloaded file exists, is non-empty and is readable media of the expected duration"""
+        if not filepath or not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+            return False
+
+        try:
+            media_info = probe_media(filepath)
+        except (subprocess.CalledProcessError, OSError, ValueError):
+            return False
+
+        if media_info['video'] is None and media_info['audio'] is None:
+            return False
+
+        if expected_duration:
+            duration = float(media_info['format'].get('duration') or 0)
+            # allow some slack for container/stream rounding
+            if duration < expected_duration * 0.95 - 1:
+                return False
+
+        return True
+
+    def download(self, url, ydl_opts, key=None, postprocess=None):
+        """
+        Download url with the given yt-dlp options and return (filepath, info).
+
+        postprocess, if given, is called with the downloaded path and returns the final
+        path (e.g. after a transcode); verification and state recording use the final
+        path. If key was already downloaded and its file still verifies, that file is
+        returned without touching the network and info is None.
+        """
+        if self.db and key:
+            state = self.db.get_download_state(key)
+            if state and state["status"] == "complete" and self.verify(state["filepath"]):
+                print(f"    Already downloaded, reusing: {state['filepath']}")
+                return state["filepath"], None
+
+            self.db.set_download_state(key, url, "downloading")
+
+        try:
+            with yt_dlp.YoutubeDL(self._ydl_opts(ydl_opts)) as ydl:
+                info = ydl.extract_info(url, download=True)
+
+                requested_downloads = info.get("requested_downloads") or [{}]
+                filepath = requested_downloads[0].get("filepath") or ydl.prepare_filename(info)
+
+            if not os.path.exists(filepath):
+                raise Exception(f"Download failed - file not found: {filepath}")
+
+            if postprocess:
+                filepath = postprocess(filepath)
+
+            expected_duration = None if ydl_opts.get('download_ranges') else info.get("duration")
+            if not self.verify(filepath, expected_duration):
+                raise Exception(f"Download failed verification: {filepath}")
+
+        except Exception as e:
+            if self.db and key:
+                self.db.set_download_state(key, url, "failed", error=str(e))
+            raise
+
+        if self.db and key:
+            self.db.set_download_state(key, url, "complete", filepath=filepath, size=os.path.getsize(filepath))
+
+        return filepath, info
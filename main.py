@@ -1,159 +1,42 @@
-import json
+import datetime
+import itertools
+import math
 import os
 import random
-import sqlite3
+import socket
 import yt_dlp
 from dotenv import load_dotenv
-from poster import XPoster
+from database import Database
+from metrics import export_metrics, finish_run, span, start_run
+from downloader import DownloadManager
+from media import TWITTER_FORMAT, ensure_twitter_compatible
+from poster import XPoster, shared_rate_limiter
+from storage import StorageManager, storage_quota_bytes
 
 load_dotenv()
 
-class Database:
-    def __init__(self, source_file=None):
-        self.db_file = source_file or "db.sqlite"
-        self.init_db()
-
-    def init_db(self):
-        """Initialize the SQLite database and create tables if they don't exist"""
-        conn = sqlite3.connect(self.db_file)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS videos (
-                id TEXT PRIMARY KEY,
-                title TEXT,
-                webpage_url TEXT,
-                filepath TEXT,
-                successful_person TEXT,
-                post_id TEXT,
-                x_media_id TEXT,
-                data TEXT  -- JSON blob for any additional data
-            )
-        ''')
-        conn.commit()
-        conn.close()
-
-    def add_video(self, video):
-        """Add a video to the database"""
-        conn = sqlite3.connect(self.db_file)
-        conn.execute('''
-            INSERT OR REPLACE INTO videos
-            (id, title, webpage_url, filepath, successful_person, post_id, data)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            video["id"],
-            video.get("title"),
-            video.get("webpage_url"),
-            video.get("filepath"),
-            video.get("successful_person"),
-            video.get("post_id"),
-            json.dumps(video)  # Store complete video data as JSON
-        ))
-        conn.commit()
-        conn.close()
-
-    def update_video(self, video_id, post_id):
-        """Update a video's post_id"""
-        conn = sqlite3.connect(self.db_file)
-        # First get the current data to update the JSON blob
-        cursor = conn.execute('SELECT data FROM videos WHERE id = ?', (video_id,))
-        row = cursor.fetchone()
-        if row:
-            video_data = json.loads(row[0])
-            video_data["post_id"] = post_id
-            conn.execute('''
-                UPDATE videos
-                SET post_id = ?, data = ?
-                WHERE id = ?
-            ''', (post_id, json.dumps(video_data), video_id))
-        conn.commit()
-        conn.close()
-
-    def update_video_media_id(self, video_id, media_id):
-        """Update a video's x_media_id"""
-        conn = sqlite3.connect(self.db_file)
-        # First get the current data to update the JSON blob
-        cursor = conn.execute('SELECT data FROM videos WHERE id = ?', (video_id,))
-        row = cursor.fetchone()
-        if row:
-            video_data = json.loads(row[0])
-            video_data["x_media_id"] = media_id
-            conn.execute('''
-                UPDATE videos
-                SET x_media_id = ?, data = ?
-                WHERE id = ?
-            ''', (media_id, json.dumps(video_data), video_id))
-        conn.commit()
-        conn.close()
-
-    def get_unposted_videos(self):
-        """Get videos that haven't been posted yet"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.execute('SELECT id, data FROM videos WHERE post_id IS NULL OR post_id = ""')
-        result = []
-        for row in cursor.fetchall():
-            video_id = row[0]
-            video_data = json.loads(row[1])
-            result.append((video_id, video_data))
-        conn.close()
-        return result
-
-    @property
-    def videos(self):
-        """Provide backward compatibility by simulating the old videos dict"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.execute('SELECT id, data FROM videos')
-        videos_dict = {}
-        for row in cursor.fetchall():
-            video_id = row[0]
-            video_data = json.loads(row[1])
-            videos_dict[video_id] = video_data
-        conn.close()
-        return videos_dict
-
-    def get_video_media_id(self, video_id):
-        """Get the cached media_id for a video"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.execute('SELECT x_media_id FROM videos WHERE id = ?', (video_id,))
-        row = cursor.fetchone()
-        conn.close()
-        return row[0] if row and row[0] else None
-
-    def delete_video(self, video_id):
-        """Delete a video from the database"""
-        conn = sqlite3.connect(self.db_file)
-        conn.execute('DELETE FROM videos WHERE id = ?', (video_id,))
-        conn.commit()
-        conn.close()
-        print(f"Deleted video {video_id} from database")
-
-    def view_records(self):
-        """View all records in the database in a formatted way"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.execute('''
-            SELECT id, title, successful_person, post_id
-            FROM videos
-            ORDER BY id
-        ''')
-
-        print("\n=== DATABASE RECORDS ===")
-        for row in cursor.fetchall():
-            video_id, title, successful_person, post_id = row
-            status = "POSTED" if post_id else "UNPOSTED"
-            print(f"ID: {video_id}")
-            print(f"Title: {title}")
-            print(f"Person: {successful_person}")
-            print(f"Status: {status}")
-            if post_id:
-                print(f"Post ID: {post_id}")
-            print("-" * 50)
-
-        conn.close()
-
 class Video:
-    def __init__(self, successful_person, db, num_videos=1, output_dir="videos"):
+    # Flat search fields worth keeping in the search cache
+    SEARCH_ENTRY_FIELDS = ("id", "url", "title", "duration", "view_count", "channel", "upload_date", "live_status")
+
+    # Title keywords used to rank candidates from the search metadata
+    PREFERRED_TITLE_KEYWORDS = ("motivation", "speech", "interview", "advice", "inspir", "commencement")
+    BLOCKED_TITLE_KEYWORDS = ("#shorts", "reaction", "compilation", "full movie", "trailer", "parody")
+
+    # Search results are pulled in batches until num_videos x CANDIDATE_POOL_FACTOR candidates
+    # pass the filters, leaving spares for failed downloads
+    SEARCH_BATCH_SIZE = 10
+    CANDIDATE_POOL_FACTOR = 3
+
+    def __init__(self, successful_person, db, num_videos=1, output_dir="videos", max_results=30, search_cache_ttl=24 * 60 * 60,
+                 download_manager=None):
         self.successful_person = successful_person
         self.num_videos = num_videos
         self.db = db
         self.output_dir = output_dir
+        self.max_results = max_results
+        self.search_cache_ttl = search_cache_ttl
+        self.download_manager = download_manager or DownloadManager(db=db)
 
         # create output directory if it doesn't exist
         os.makedirs(self.output_dir, exist_ok=True)
@@ -181,135 +64,271 @@ class Video:
 
         return None  # None means accept the video
 
+    def _candidate_score(self, entry, known_videos):
+        """Ranking score of a flat search entry, or None if it is filtered out"""
+        video_id = entry["id"]
+        title = (entry.get("title") or "").lower()
+
+        if entry.get("live_status") in ("is_live", "is_upcoming"):
+            return None
+
+        existing_video = known_videos.get(video_id)
+        if existing_video:
+            if existing_video.get("post_id"):
+                return None
+            if existing_video.get("filepath") and os.path.exists(existing_video["filepath"]):
+                return None
+            print(f"    WARNING: Database entry exists but file missing: {existing_video.get('filepath')}")
+
+        if any(keyword in title for keyword in self.BLOCKED_TITLE_KEYWORDS):
+            return None
+
+        if self._duration_filter(entry) is not None:
+            return None
+
+        score = math.log10((entry.get("view_count") or 0) + 1)
+        score += sum(1 for keyword in self.PREFERRED_TITLE_KEYWORDS if keyword in title)
+        if entry.get("upload_date"):
+            # small penalty per year of age
+            score -= 0.1 * max(0, datetime.date.today().year - int(entry["upload_date"][:4]))
+
+        return score
+
+    def rank_candidates(self, entries, limit=None):
+        """
+        Filter and rank flat search entries before anything is downloaded.
+
+        Uses only the cheap metadata from the flat search: live/upcoming streams, videos
+        outside the duration limits, blocked title keywords and videos we already have
+        (on disk or posted) are discarded. The rest are ordered by popularity (log of the
+        view count), motivational title keywords and recency.
+
+        entries may be a lazy search; it is read a batch of SEARCH_BATCH_SIZE at a time,
+        looking the batch up in the Database. With limit, reading stops once limit
+        candidates passed the filters, and the entries read so far are ranked.
+        """
+        entries = iter(entries)
+        known_videos = {}
+        candidates = []
+
+        while limit is None or len(candidates) < limit:
+            batch = list(itertools.islice(entries, self.SEARCH_BATCH_SIZE))
+            if not batch:
+                break
+
+            known_videos.update(self.db.get_videos(entry["id"] for entry in batch))
+            for entry in batch:
+                score = self._candidate_score(entry, known_videos)
+                if score is not None:
+                    candidates.append((score, entry))
+
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return [entry for _, entry in candidates]
+
+    def _search_entries(self, query):
+        """
+        Lazily yield flat search results for the query.
+
+        Results come from the Database search cache while it is fresher than
+        search_cache_ttl. Otherwise a single flat (extract_flat) search is paginated
+        lazily, so only as many result pages are fetched as the caller consumes. Whatever
+        was fetched is cached. A partial cache is yielded first and then topped up by a
+        fresh search, which starts again from the first result page and skips the ids that
+        were cached (ytsearch has no start offset).
+        """
+        cached = self.db.get_search_results(self.successful_person, query, self.search_cache_ttl)
+        entries, complete = cached or ([], False)
+
+        if entries:
+            print(f"Using {len(entries)} cached search results for {self.successful_person}")
+        yield from entries
+
+        if complete:
+            return
+
+        seen_ids = {entry["id"] for entry in entries}
+        print(f"Searching for up to {self.max_results} videos...")
+
+        try:
+            with yt_dlp.YoutubeDL({'extract_flat': 'in_playlist', 'quiet': True}) as ydl:
+                result = ydl.extract_info(f"ytsearch{self.max_results}:{query}", download=False, process=False)
+
+                for entry in result.get("entries") or []:
+                    if not entry.get("id") or entry["id"] in seen_ids:
+                        continue
+
+                    entry = {field: entry.get(field) for field in self.SEARCH_ENTRY_FIELDS}
+                    seen_ids.add(entry["id"])
+                    entries.append(entry)
+                    yield entry
+
+            complete = True
+        finally:
+            self.db.save_search_results(self.successful_person, query, entries, complete)
+
     def get_videos(self):
         query = f"motivational interview or speech or talk + {self.successful_person}"
 
         # Specify exact output path and duration limit for Twitter
         ydl_opts = {
             'outtmpl': os.path.join(self.output_dir, '%(title)s.%(ext)s'),
+            # Prefer native H.264/AAC streams; anything else is transcoded after probing
+            'format': TWITTER_FORMAT,
             'merge_output_format': 'mp4',
-            # Post-processors to ensure MP4 with H.264 codec for Twitter compatibility
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-            # Force re-encoding to H.264 if needed
-            'postprocessor_args': {
-                'ffmpeg': ['-c:v', 'libx264', '-c:a', 'aac', '-preset', 'medium']
-            },
             # Only download videos under 10 minutes (600 seconds) for Twitter compatibility
             'match_filter': self._duration_filter,
         }
 
-        # Progressive search expansion: start with 5, then 10, 20, 30 videos
-        search_sizes = [5, 10, 20, 30]
-        checked_video_ids = set()  # Track videos we've already processed
-
-        for search_size in search_sizes:
-            print(f"Searching for {search_size} videos...")
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = ydl.extract_info(f"ytsearch{search_size}:{query}", download=False)
-
-                print(f"Found {len(result['entries'])} potential videos for {self.successful_person}")
-                new_videos_in_batch = 0
-
-                for i, entry in enumerate(result["entries"]):
-                    video_id = entry["id"]
-                    video_title = entry.get("title", "Unknown Title")
-
-                    # Skip if we've already checked this video in a previous search
-                    if video_id in checked_video_ids:
-                        continue
-
-                    # Add to checked set
-                    checked_video_ids.add(video_id)
-                    new_videos_in_batch += 1
-
-                    # Check if video is already in database
-                    if video_id in self.db.videos:
-                        print(f"  [{i+1}] SKIP: Video already in database - {video_title[:60]}...")
-
-                        # Double-check if the file actually exists on disk
-                        existing_video = self.db.videos[video_id]
-                        if existing_video.get("filepath") and os.path.exists(existing_video["filepath"]):
-                            continue
-                        else:
-                            print(f"    WARNING: Database entry exists but file missing: {existing_video.get('filepath')}")
-                            print(f"    Re-downloading this video...")
-
-                    print(f"  [{i+1}] DOWNLOADING: {video_title[:60]}...")
-
-                    try:
-                        # download the video and get the actual file path
-                        download_result = ydl.extract_info(entry["webpage_url"], download=True)
-                        actual_filename = ydl.prepare_filename(download_result)
-
-                        # Verify the file was actually downloaded
-                        if not os.path.exists(actual_filename):
-                            print(f"    ERROR: Download failed - file not found: {actual_filename}")
-                            continue
-
-                        # add filepath to entry
-                        entry["filepath"] = actual_filename
-                        # add successful person to entry
-                        entry["successful_person"] = self.successful_person
-                        self.db.add_video(entry)
-
-                        print(f"    SUCCESS: Downloaded and saved to database")
-                        print(f"    File: {actual_filename}")
-                        return entry["id"]
-
-                    except Exception as e:
-                        print(f"    ERROR: Failed to download video {video_id}: {str(e)}")
-                        continue
-
-                print(f"No new videos found in this batch ({new_videos_in_batch} new videos checked, {len(checked_video_ids)} total checked)")
-
-        print(f"ERROR: No new videos found for {self.successful_person} after checking {len(checked_video_ids)} total videos")
+        # One cheap metadata pass over only as many search results as needed, then download in rank order
+        with span("search"):
+            search = self._search_entries(query)
+            try:
+                candidates = self.rank_candidates(search, limit=self.num_videos * self.CANDIDATE_POOL_FACTOR)
+            finally:
+                # caches what was fetched, so a later search yields it without fetching it again
+                search.close()
+        print(f"Found {len(candidates)} candidate videos for {self.successful_person}")
+
+        harvested = []
+
+        try:
+            for i, entry in enumerate(candidates):
+                if len(harvested) >= self.num_videos:
+                    break
+
+                video_id = entry["id"]
+                video_title = entry.get("title") or "Unknown Title"
+
+                print(f"  [{i+1}] DOWNLOADING: {video_title[:60]}...")
+
+                try:
+                    # download (or resume) the video; only transcode if it violates X's upload constraints
+                    with span("download") as download_span:
+                        actual_filename, download_result = self.download_manager.download(
+                            entry["url"], ydl_opts, key=video_id, postprocess=ensure_twitter_compatible
+                        )
+                        download_span["bytes"] = os.path.getsize(actual_filename)
+
+                    # a previously completed download only has the search metadata
+                    video_info = download_result or {**entry, "webpage_url": entry["url"]}
+
+                    # add filepath to the full video info
+                    video_info["filepath"] = actual_filename
+                    # add successful person to the full video info
+                    video_info["successful_person"] = self.successful_person
+                    harvested.append(video_info)
+
+                    print(f"    SUCCESS: Downloaded {actual_filename}")
+
+                except Exception as e:
+                    print(f"    ERROR: Failed to download video {video_id}: {str(e)}")
+                    continue
+        finally:
+            # ingest everything harvested in one transaction, even if the run is interrupted
+            if harvested:
+                self.db.add_videos(harvested)
+                print(f"Saved {len(harvested)} videos to database")
+
+        if harvested:
+            return harvested[0]["id"]
+
+        print(f"ERROR: No new videos found for {self.successful_person} after trying {len(candidates)} candidates")
         return None
 
 
-def get_successful_person():
+def get_successful_people():
     with open("successful.txt", "r") as f:
         lines = f.read().splitlines()
 
     # remove comments and empty lines
-    lines = [line for line in lines if not line.startswith("#") and line.strip()]
-    # return one random line
-    return random.choice(lines)
+    return [line for line in lines if not line.startswith("#") and line.strip()]
 
-if __name__ == "__main__":
-    db = Database()
-    # get unposted videos
-    unposted_videos = db.get_unposted_videos()
-
-    if unposted_videos:
-        print("Found unposted videos!!")
-        video_id, video_data = unposted_videos[0]
+def get_successful_person():
+    # return one random line
+    return random.choice(get_successful_people())
+
+def run_once(db, xposter=None, worker_id=None, lease_secs=2 * 60 * 60, tweet_lease_secs=60 * 60,
+             retry_delay_secs=60 * 60):
+    """
+    Claim the next queued video (harvesting new ones if the queue is empty) and post it.
+
+    Returns the post id, or None if no video could be found. Posting errors are raised
+    after the video is put back in the queue, not to be retried for retry_delay_secs, so
+    a video that keeps failing doesn't block the ones behind it. The claim is held for
+    lease_secs and renewed for tweet_lease_secs (enough for the tweet's rate-limit waits)
+    right before tweeting; if another worker took the video over meanwhile, nothing is
+    tweeted. Stage timings are recorded as a "post" run.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+    # time every stage of this run (see `python metrics.py`)
+    start_run(db, "post")
+    run_status = "error"
+
+    try:
+        # claim the next unposted video, so concurrent runs never post the same one
+        video_data = db.claim_next(worker_id, lease_secs=lease_secs)
+
+        if video_data:
+            print("Found unposted videos!!")
+        else:
+            print("No unposted videos found, getting new ones")
+
+            # get successful name
+            successful_person = get_successful_person()
+
+            video = Video(successful_person, db)
+            if video.get_videos() is None:
+                print("ERROR: Could not download any new videos.")
+                return None
+
+            video_data = db.claim_next(worker_id, lease_secs=lease_secs)
+            if video_data is None:
+                print("ERROR: New video was claimed by another worker.")
+                return None
+
+        video_id = video_data["id"]
         file_path = video_data["filepath"]
-        successful_person = video_data["successful_person"]
-    else:
-        print("No unposted videos found, getting new ones")
-
-        # get successful name
-        successful_person = get_successful_person()
 
-        video = Video(successful_person, db)
-        video_id = video.get_videos()
+        print(f"Posting video {video_id} with title {video_data['title']}")
 
-        if video_id is None:
-            print("ERROR: Could not download any new videos. Exiting.")
-            exit(1)
+        def renew_lease():
+            # the upload may have outlived the lease, make sure no other worker took the video over
+            if not db.renew_lease(video_id, worker_id, lease_secs=tweet_lease_secs):
+                raise Exception(f"Lost the claim on video {video_id}, not tweeting it")
 
-        video_data = db.videos[video_id]
-        file_path = video_data["filepath"]
-
-    print(f"Posting video {video_id} with title {video_data['title']}")
+        try:
+            # Initialize XPoster - will use community_id from environment variable if set
+            xposter = xposter or XPoster(db=db)
+            post_id = xposter.post(
+                file_path, video_data["title"], video_data["webpage_url"], video_id=video_id,
+                caption=video_data.get("caption"), before_tweet=renew_lease,
+            )
+        except Exception:
+            # put the video back in the queue, behind the others for a while
+            db.release(video_id, worker_id, delay_secs=retry_delay_secs)
+            raise
+
+        print(f"Posted video {video_id}")
+        # mark the video as posted with the post_id
+        if not db.complete(video_id, worker_id, post_id):
+            print(f"ERROR: Lost the claim on video {video_id} while tweeting it, it may be posted twice; "
+                  f"recording post {post_id} anyway")
+            db.update_video(video_id, post_id)
+
+        # keep videos/ and extracted_snippets/ under the configured quota
+        quota_bytes = storage_quota_bytes()
+        if quota_bytes:
+            with span("storage"):
+                StorageManager(db, quota_bytes).enforce()
+
+        run_status = "ok"
+        return post_id
+    finally:
+        finish_run(run_status)
+        export_metrics(db, shared_rate_limiter.gauges())
 
-    # Initialize XPoster - will use community_id from environment variable if set
-    xposter = XPoster(db=db)
-    post_id = xposter.post(file_path, video_data["title"], video_data["webpage_url"], video_id=video_id)
-    print(f"Posted video {video_id}")
-    # update the video with the post_id
-    db.update_video(video_id, post_id)
+if __name__ == "__main__":
+    if run_once(Database()) is None:
+        print("Exiting.")
+        exit(1)
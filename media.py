@@ -0,0 +1,477 @@
+import bisect
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+
+from metrics import span
+
+
+def ffprobe(video_path, *args):
+    """Run ffprobe with JSON output and return the parsed result"""
+    cmd = ['ffprobe', '-v', 'error', *args, '-of', 'json', video_path]
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout)
+
+def probe_video_stream(video_path):
+    """Return codec information for the first video stream, or None if there isn't one"""
+    streams = ffprobe(
+        video_path,
+        '-select_streams', 'v:0',
+        '-show_entries',
+        'stream=codec_name,profile,level,pix_fmt,width,height,color_range,color_space,color_transfer,color_primaries',
+    ).get('streams', [])
+    return streams[0] if streams else None
+
+def get_keyframes(video_path):
+    """
+    Return the sorted keyframe timestamps (in seconds) of a video.
+
+    The index is built once with ffprobe from packet flags (no decoding) and cached
+    next to the video as `<video>.keyframes.json`. The cache is rebuilt if the video's
+    size or modification time changes.
+    """
+    index_file = f"{video_path}.keyframes.json"
+    stat = os.stat(video_path)
+
+    if os.path.exists(index_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime:
+            return index['keyframes']
+
+    print(f"Indexing keyframes for {os.path.basename(video_path)}...")
+    packets = ffprobe(
+        video_path,
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+    ).get('packets', [])
+
+    keyframes = sorted(
+        float(packet['pts_time'])
+        for packet in packets
+        if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')
+    )
+
+    with open(index_file, 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'keyframes': keyframes}, f)
+
+    return keyframes
+
+def snap_to_keyframe(timestamp, keyframes, tolerance):
+    """Move timestamp to the nearest keyframe if one lies within tolerance seconds"""
+    if not keyframes or not tolerance:
+        return timestamp
+
+    i = bisect.bisect_left(keyframes, timestamp)
+    candidates = keyframes[max(0, i - 1):i + 1]
+    nearest = min(candidates, key=lambda k: abs(k - timestamp))
+
+    return nearest if abs(nearest - timestamp) <= tolerance else timestamp
+
+# Bump when smart cutting changes, so stored smart-cut snippets are cut again
+SMART_CUT_VERSION = 2
+
+# ffprobe's H.264 profile names and the matching libx264 -profile:v
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+
+def _matching_encode_args(stream, threads):
+    """
+    libx264 arguments for edge segments that match the source stream's parameter sets.
+
+    Profile, level, pixel format and colour signalling follow the source, and SPS/PPS
+    are repeated in-band so each segment carries its own parameter sets.
+    """
+    args = ['-c:v', 'libx264', '-preset', 'fast', '-crf', '20', '-pix_fmt', stream.get('pix_fmt') or 'yuv420p']
+
+    profile = X264_PROFILES.get(stream.get('profile'))
+    if profile:
+        args += ['-profile:v', profile]
+    level = stream.get('level')
+    if isinstance(level, int) and level > 0:
+        args += ['-level:v', f"{level / 10:.1f}"]
+
+    x264_params = ['repeat-headers=1']
+    for key, x264_key in (('color_primaries', 'colorprim'), ('color_transfer', 'transfer'), ('color_space', 'colormatrix')):
+        if stream.get(key) and stream[key] != 'unknown':
+            x264_params.append(f"{x264_key}={stream[key]}")
+    if stream.get('color_range') in ('tv', 'pc'):
+        x264_params.append(f"range={stream['color_range']}")
+
+    return args + ['-x264-params', ':'.join(x264_params), '-threads', str(threads), '-an']
+
+# ffprobe messages that mean a frame was decoded wrong, rather than harmless warnings
+DECODE_ERRORS = (
+    'error while decoding', 'non-existing pps', 'no frame!', 'decode_slice_header error',
+    'invalid nal unit', 'missing picture', 'concealing',
+)
+
+def verify_video(video_path, expected_duration, seams=(), window=1.0, tolerance=0.5):
+    """
+    Check a video is about expected_duration long and decodes cleanly around each seam.
+
+    Only the frames within window seconds of each seam (a time in the output where two
+    segments were joined) are decoded, so verifying stays cheap next to the cut itself.
+    A failing ffprobe, a seam without decoded frames or a decoding error rejects it.
+    """
+    intervals = ",".join(f"{max(0.0, seam - window):.3f}%+{2 * window:.3f}" for seam in seams)
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration']
+    if intervals:
+        cmd = [
+            'ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', intervals,
+            '-show_entries', 'format=duration:frame=best_effort_timestamp_time',
+        ]
+    result = subprocess.run([*cmd, '-of', 'json', video_path], capture_output=True, text=True)
+    if result.returncode != 0:
+        return False
+
+    errors = [line for line in result.stderr.lower().splitlines() if any(e in line for e in DECODE_ERRORS)]
+    if errors:
+        return False
+
+    info = json.loads(result.stdout)
+    duration = float(info.get('format', {}).get('duration') or 0)
+    if abs(duration - expected_duration) > tolerance:
+        return False
+
+    times = [float(frame['best_effort_timestamp_time']) for frame in info.get('frames', [])
+             if frame.get('best_effort_timestamp_time') not in (None, 'N/A')]
+    return all(any(abs(t - seam) <= window for t in times) for seam in seams)
+
+def smart_cut_video(video_path, start_time, end_time, output_file, keyframes, stream=None, threads=1):
+    """
+    Cut [start_time, end_time) re-encoding only the partial GOPs at the edges.
+
+    The video between the first keyframe at or after start_time and the last keyframe
+    at or before end_time is stream-copied. The head and tail are re-encoded with
+    libx264 matching the source's profile, level and pixel format into MPEG-TS
+    segments, and concatenated with the copied middle. The MP4 is tagged avc3 so the
+    differing SPS/PPS of the segments stay in-band. Audio is re-encoded in a single
+    pass to keep it gapless.
+
+    stream is the source's probe_video_stream() result; pass it in to probe a source
+    only once for all of its snippets.
+
+    Returns False (leaving no output) if the source isn't H.264, the cut doesn't contain
+    a whole GOP, or the result doesn't decode cleanly around the joins, so the caller
+    can fall back to a full re-encode.
+    """
+    stream = stream or probe_video_stream(video_path)
+    if not stream or stream.get('codec_name') != 'h264':
+        return False
+
+    first = bisect.bisect_left(keyframes, start_time)
+    last = bisect.bisect_right(keyframes, end_time) - 1
+    if first >= len(keyframes) or last < 0 or keyframes[first] >= keyframes[last]:
+        return False
+
+    copy_start = keyframes[first]
+    copy_end = keyframes[last]
+
+    encode_args = _matching_encode_args(stream, threads)
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='smartcut_') as tmp_dir:
+            segments = []
+
+            if copy_start > start_time:
+                head = os.path.join(tmp_dir, 'head.ts')
+                subprocess.run([
+                    'ffmpeg', '-ss', str(start_time), '-i', video_path,
+                    '-t', str(copy_start - start_time), *encode_args, '-y', head
+                ], check=True, capture_output=True)
+                segments.append(head)
+
+            middle = os.path.join(tmp_dir, 'middle.ts')
+            subprocess.run([
+                'ffmpeg', '-ss', str(copy_start), '-i', video_path,
+                '-t', str(copy_end - copy_start), '-an',
+                '-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb', '-y', middle
+            ], check=True, capture_output=True)
+            segments.append(middle)
+
+            if end_time > copy_end:
+                tail = os.path.join(tmp_dir, 'tail.ts')
+                subprocess.run([
+                    'ffmpeg', '-ss', str(copy_end), '-i', video_path,
+                    '-t', str(end_time - copy_end), *encode_args, '-y', tail
+                ], check=True, capture_output=True)
+                segments.append(tail)
+
+            concat_list = os.path.join(tmp_dir, 'segments.txt')
+            with open(concat_list, 'w') as f:
+                for segment in segments:
+                    f.write(f"file '{segment}'\n")
+
+            subprocess.run([
+                'ffmpeg',
+                '-f', 'concat', '-safe', '0', '-i', concat_list,
+                '-ss', str(start_time), '-t', str(end_time - start_time), '-i', video_path,
+                '-map', '0:v:0', '-map', '1:a:0?',
+                '-c:v', 'copy', '-tag:v', 'avc3',
+                '-c:a', 'aac',
+                '-movflags', '+faststart',
+                '-y', output_file
+            ], check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Smart cut of {os.path.basename(output_file)} failed, falling back to full re-encode: {e}")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        return False
+
+    # the joins between re-encoded edges and the copied middle, in output time
+    seams = [seam - start_time for seam in (copy_start, copy_end) if start_time < seam < end_time]
+    if not verify_video(output_file, end_time - start_time, seams=seams):
+        print(f"Smart cut of {os.path.basename(output_file)} doesn't decode cleanly, falling back to full re-encode")
+        os.remove(output_file)
+        return False
+
+    return True
+
+# Prefer streams X accepts as-is (H.264 video + AAC audio in MP4) so downloads rarely need a transcode
+TWITTER_FORMAT = (
+    'bestvideo[vcodec^=avc1][height<=1080][fps<=60]+bestaudio[acodec^=mp4a]'
+    '/best[vcodec^=avc1][acodec^=mp4a][height<=1080]'
+    '/bestvideo[height<=1080]+bestaudio'
+    '/best'
+)
+
+# X media upload constraints for video
+TWITTER_VIDEO_PROFILES = ('Baseline', 'Constrained Baseline', 'Main', 'High')
+TWITTER_MAX_LONG_SIDE = 1920
+TWITTER_MAX_SHORT_SIDE = 1200
+TWITTER_MAX_FPS = 60
+TWITTER_MAX_BYTES = 512 * 1024 * 1024
+
+def _parse_frame_rate(rate):
+    try:
+        num, den = rate.split('/')
+        return float(num) / float(den) if float(den) else 0.0
+    except (AttributeError, ValueError):
+        return 0.0
+
+def probe_media(video_path):
+    """Return the container format and first video/audio streams of a media file"""
+    result = ffprobe(
+        video_path,
+        '-show_entries',
+        'format=format_name,duration,size,bit_rate:'
+        'stream=codec_type,codec_name,profile,pix_fmt,width,height,avg_frame_rate,channels,bit_rate',
+    )
+
+    streams = result.get('streams', [])
+    return {
+        'format': result.get('format', {}),
+        'video': next((s for s in streams if s.get('codec_type') == 'video'), None),
+        'audio': next((s for s in streams if s.get('codec_type') == 'audio'), None),
+    }
+
+def twitter_violations(video_path, media_info=None):
+    """
+    Check a video against X's upload constraints.
+
+    Returns a dict with the reasons the 'video', 'audio' and 'container' parts violate
+    the constraints (empty lists when compliant), so only offending streams need work.
+    """
+    media_info = media_info or probe_media(video_path)
+    video = media_info['video']
+    audio = media_info['audio']
+    violations = {'video': [], 'audio': [], 'container': []}
+
+    if video is None:
+        violations['video'].append("no video stream")
+    else:
+        if video.get('codec_name') != 'h264':
+            violations['video'].append(f"codec {video.get('codec_name')} is not h264")
+        elif video.get('profile') not in TWITTER_VIDEO_PROFILES:
+            violations['video'].append(f"h264 profile {video.get('profile')} is not supported")
+        if video.get('pix_fmt') != 'yuv420p':
+            violations['video'].append(f"pixel format {video.get('pix_fmt')} is not yuv420p")
+
+        width = video.get('width') or 0
+        height = video.get('height') or 0
+        if max(width, height) > TWITTER_MAX_LONG_SIDE or min(width, height) > TWITTER_MAX_SHORT_SIDE:
+            violations['video'].append(f"resolution {width}x{height} is too large")
+
+        fps = _parse_frame_rate(video.get('avg_frame_rate'))
+        if fps > TWITTER_MAX_FPS:
+            violations['video'].append(f"frame rate {fps:.2f} exceeds {TWITTER_MAX_FPS}")
+
+    if audio is not None:
+        if audio.get('codec_name') != 'aac':
+            violations['audio'].append(f"codec {audio.get('codec_name')} is not aac")
+        if (audio.get('channels') or 0) > 2:
+            violations['audio'].append(f"{audio.get('channels')} audio channels (max 2)")
+
+    format_name = media_info['format'].get('format_name', '')
+    if 'mp4' not in format_name.split(',') or not video_path.endswith('.mp4'):
+        violations['container'].append(f"container {format_name} is not mp4")
+
+    if int(media_info['format'].get('size') or 0) > TWITTER_MAX_BYTES:
+        violations['video'].append("file exceeds 512MB")
+
+    return violations
+
+def ensure_twitter_compatible(video_path):
+    """
+    Make sure a video satisfies X's upload constraints, transcoding only when needed.
+
+    Compliant videos are returned untouched. Otherwise only the violating streams are
+    re-encoded (the other is stream-copied) into an .mp4 next to the original, which
+    is then replaced. Returns the path of the compliant file.
+    """
+    media_info = probe_media(video_path)
+    violations = twitter_violations(video_path, media_info)
+    if not any(violations.values()):
+        print(f"    Already X-compatible, skipping transcode: {os.path.basename(video_path)}")
+        return video_path
+
+    for part, reasons in violations.items():
+        for reason in reasons:
+            print(f"    Needs transcode ({part}): {reason}")
+
+    if violations['video']:
+        video_args = ['-c:v', 'libx264', '-preset', 'medium', '-profile:v', 'high', '-pix_fmt', 'yuv420p']
+
+        video = media_info['video'] or {}
+        width = video.get('width') or 0
+        height = video.get('height') or 0
+        filters = []
+
+        scale = min(1.0, TWITTER_MAX_LONG_SIDE / max(width, height, 1), TWITTER_MAX_SHORT_SIDE / max(min(width, height), 1))
+        if scale < 1.0:
+            filters.append(f"scale={int(width * scale) // 2 * 2}:{int(height * scale) // 2 * 2}")
+        if _parse_frame_rate(video.get('avg_frame_rate')) > TWITTER_MAX_FPS:
+            filters.append(f"fps={TWITTER_MAX_FPS}")
+        if filters:
+            video_args += ['-vf', ','.join(filters)]
+    else:
+        video_args = ['-c:v', 'copy']
+
+    audio_args = ['-c:a', 'aac', '-ac', '2'] if violations['audio'] else ['-c:a', 'copy']
+
+    output_path = os.path.splitext(video_path)[0] + '.mp4'
+    tmp_path = output_path + '.transcode.mp4'
+
+    with span("transcode", bytes_processed=os.path.getsize(video_path)):
+        subprocess.run([
+            'ffmpeg', '-i', video_path,
+            '-map', '0:v:0', '-map', '0:a:0?',
+            *video_args, *audio_args,
+            '-movflags', '+faststart',
+            '-y', tmp_path
+        ], check=True, capture_output=True)
+
+    os.replace(tmp_path, output_path)
+    if output_path != video_path:
+        os.remove(video_path)
+
+    return output_path
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# One lock per upload encode output, so posting and prefetching don't encode the same video twice
+_encode_locks = {}
+_encode_locks_lock = threading.Lock()
+
+def _encode_lock(output_file):
+    with _encode_locks_lock:
+        return _encode_locks.setdefault(output_file, threading.Lock())
+
+def encode_for_upload(video_path, cache_dir="upload_cache", max_short_side=720, max_video_kbps=2500,
+                      audio_kbps=128, max_bytes=TWITTER_MAX_BYTES):
+    """
+    Encode a video to a size-targeted upload profile and return the path to upload.
+
+    X re-encodes uploads for playback anyway, so anything above its playback quality
+    only costs upload bytes and time. The target bitrate is the lower of the profile
+    cap (max_video_kbps + audio_kbps) and what fits the clip's duration into max_bytes.
+    The video is scaled so its short side is at most max_short_side and encoded with
+    two-pass libx264; audio is capped at audio_kbps stereo AAC.
+
+    Results are cached in cache_dir by source file hash and profile. Sources that are
+    already at or below the target bitrate are returned unchanged. Concurrent calls for
+    the same video wait for one encode, and each encode writes its own temp file that is
+    renamed into place, so other processes never see a partial result.
+    """
+    media_info = probe_media(video_path)
+    video = media_info['video'] or {}
+    duration = float(media_info['format'].get('duration') or 0)
+    if duration <= 0 or not video:
+        return video_path
+
+    budget_kbps = max_bytes * 8 * 0.95 / duration / 1000
+    total_kbps = min(max_video_kbps + audio_kbps, budget_kbps)
+    video_kbps = max(300, int(total_kbps - audio_kbps))
+
+    width = video.get('width') or 0
+    height = video.get('height') or 0
+    scale = min(1.0, max_short_side / max(min(width, height), 1))
+    source_kbps = float(media_info['format'].get('bit_rate') or 0) / 1000
+
+    if scale == 1.0 and source_kbps and source_kbps <= total_kbps * 1.1:
+        return video_path
+
+    profile = f"{max_short_side}p-{video_kbps}k-{audio_kbps}k"
+    os.makedirs(cache_dir, exist_ok=True)
+    output_file = os.path.join(cache_dir, f"{file_hash(video_path)}-{profile}.mp4")
+
+    with _encode_lock(output_file):
+        if os.path.exists(output_file):
+            print(f"Using cached upload encode: {output_file}")
+            return output_file
+
+        print(f"Encoding {os.path.basename(video_path)} for upload ({profile}, {source_kbps:.0f}k source)...")
+
+        video_args = [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-profile:v', 'high',
+            '-pix_fmt', 'yuv420p',
+            '-b:v', f'{video_kbps}k',
+            '-maxrate', f'{int(video_kbps * 1.5)}k',
+            '-bufsize', f'{video_kbps * 2}k',
+        ]
+        if scale < 1.0:
+            video_args += ['-vf', f"scale={int(width * scale) // 2 * 2}:{int(height * scale) // 2 * 2}"]
+
+        with tempfile.TemporaryDirectory(prefix='upload_encode_', dir=cache_dir) as tmp_dir:
+            passlog = os.path.join(tmp_dir, 'passlog')
+            tmp_file = os.path.join(tmp_dir, 'encode.mp4')
+
+            subprocess.run([
+                'ffmpeg', '-i', video_path, *video_args,
+                '-pass', '1', '-passlogfile', passlog,
+                '-an', '-f', 'mp4', '-y', os.devnull
+            ], check=True, capture_output=True)
+
+            subprocess.run([
+                'ffmpeg', '-i', video_path, *video_args,
+                '-pass', '2', '-passlogfile', passlog,
+                '-c:a', 'aac', '-b:a', f'{audio_kbps}k', '-ac', '2',
+                '-movflags', '+faststart',
+                '-y', tmp_file
+            ], check=True, capture_output=True)
+
+            # same filesystem as output_file, so the rename is atomic
+            os.replace(tmp_file, output_file)
+
+    print(f"Upload encode: {os.path.getsize(video_path) / 1e6:.1f}MB -> {os.path.getsize(output_file) / 1e6:.1f}MB")
+
+    return output_file
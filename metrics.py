@@ -0,0 +1,294 @@
+import argparse
+import math
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# The run that spans are currently recorded into (None records nothing)
+_current_run = None
+
+# Runs of background threads (e.g. the prefetcher), which take precedence over _current_run
+# for spans on their own thread
+_thread_runs = threading.local()
+
+
+class Run:
+    """A single pipeline run whose stage spans are recorded in the Database runs tables"""
+
+    def __init__(self, db, kind):
+        self.db = db
+        self.kind = kind
+        self.id = db.start_run(kind)
+
+    def record(self, stage, started_at, wall_secs, cpu_secs, peak_rss_kb, bytes_processed, status):
+        self.db.record_stage(self.id, stage, started_at, wall_secs, cpu_secs, peak_rss_kb, bytes_processed, status)
+
+    def finish(self, status="ok"):
+        self.db.finish_run(self.id, status)
+
+
+def start_run(db, kind, thread_only=False):
+    """
+    Start recording spans into a new run of the given kind (e.g. "post", "longform").
+
+    With thread_only, the run only records spans on the calling thread and leaves the
+    process-wide run (and the worker threads recording into it) alone.
+    """
+    global _current_run
+    run = Run(db, kind)
+    if thread_only:
+        _thread_runs.run = run
+    else:
+        _current_run = run
+    return run
+
+def finish_run(status="ok"):
+    """Finish the calling thread's own run if it has one, else the current run, and stop recording spans"""
+    global _current_run
+    run = getattr(_thread_runs, "run", None)
+    if run is not None:
+        _thread_runs.run = None
+    else:
+        run, _current_run = _current_run, None
+    if run is not None:
+        run.finish(status)
+
+def _cpu_seconds():
+    # This process plus waited-for children (ffmpeg subprocesses)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def _rss_kb(pid):
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+def _current_rss_kb():
+    """Current RSS of this process plus its running children (ffmpeg), or None without /proc"""
+    try:
+        total = _rss_kb(os.getpid())
+    except (OSError, ValueError):
+        return None
+
+    try:
+        tasks = os.listdir(f"/proc/{os.getpid()}/task")
+    except OSError:
+        tasks = []
+
+    for task in tasks:
+        try:
+            with open(f"/proc/{os.getpid()}/task/{task}/children") as f:
+                children = f.read().split()
+        except OSError:
+            continue
+        for child in children:
+            try:
+                total += _rss_kb(child)
+            except (OSError, ValueError):
+                pass  # already exited
+
+    return total
+
+class _RssSampler:
+    """
+    Samples RSS in a background thread while spans are open, tracking each span's peak.
+
+    ru_maxrss is the lifetime high-water mark of the process, so after the first heavy
+    stage every later stage would report the same peak; sampling gives each stage its own.
+    """
+
+    def __init__(self, interval_secs=0.2):
+        self.interval_secs = interval_secs
+        self._lock = threading.Lock()
+        self._peaks = {}  # span token -> peak RSS in KB
+        self._thread = None
+
+    def _run(self):
+        while True:
+            rss = _current_rss_kb()
+            with self._lock:
+                if not self._peaks:
+                    self._thread = None
+                    return
+                for token, peak in self._peaks.items():
+                    self._peaks[token] = max(peak, rss or 0)
+            time.sleep(self.interval_secs)
+
+    def start(self):
+        """Start tracking a span's peak; returns its token, or None where RSS can't be sampled"""
+        rss = _current_rss_kb()
+        if rss is None:
+            return None
+
+        token = object()
+        with self._lock:
+            self._peaks[token] = rss
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        return token
+
+    def stop(self, token):
+        """Stop tracking a span; returns its peak RSS in KB"""
+        if token is None:
+            # no /proc: fall back to the process-lifetime peak
+            return max(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            )
+
+        rss = _current_rss_kb() or 0
+        with self._lock:
+            return max(self._peaks.pop(token), rss)
+
+_rss_sampler = _RssSampler()
+
+@contextmanager
+def span(stage, bytes_processed=None):
+    """
+    Time a pipeline stage and record it into the current run.
+
+    Records wall time, CPU time (including child processes), peak RSS sampled during
+    the stage (this process plus its running children) and bytes processed. The yielded
+    dict can be used to set "bytes" once they are known. CPU time and RSS are
+    process-wide, so spans running concurrently share them.
+    """
+    info = {"bytes": bytes_processed}
+    started_at = time.time()
+    wall_start = time.perf_counter()
+    cpu_start = _cpu_seconds()
+    rss_token = _rss_sampler.start()
+    status = "ok"
+
+    try:
+        yield info
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        peak_rss_kb = _rss_sampler.stop(rss_token)
+        run = getattr(_thread_runs, "run", None) or _current_run
+        if run is not None:
+            run.record(
+                stage,
+                started_at,
+                time.perf_counter() - wall_start,
+                _cpu_seconds() - cpu_start,
+                peak_rss_kb,
+                info["bytes"],
+                status,
+            )
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+def stage_summary(db, last_runs=20):
+    """Summarize stage timings over the last runs as {stage: stats}"""
+    stages = {}
+    for row in db.get_stage_timings(last_runs):
+        stages.setdefault(row["stage"], []).append(row)
+
+    summary = {}
+    for stage, rows in stages.items():
+        wall = [row["wall_secs"] for row in rows]
+        cpu = [row["cpu_secs"] for row in rows]
+        summary[stage] = {
+            "count": len(rows),
+            "errors": sum(1 for row in rows if row["status"] != "ok"),
+            "wall_p50": percentile(wall, 50),
+            "wall_p95": percentile(wall, 95),
+            "cpu_p50": percentile(cpu, 50),
+            "cpu_p95": percentile(cpu, 95),
+            "wall_sum": sum(wall),
+            "peak_rss_kb": max(row["peak_rss_kb"] or 0 for row in rows),
+            "bytes": sum(row["bytes"] or 0 for row in rows),
+        }
+    return summary
+
+def export_prometheus(db, path, last_runs=20, extra_gauges=None):
+    """
+    Write stage metrics to a Prometheus textfile (for node_exporter's textfile collector).
+
+    extra_gauges maps metric name to a list of (labels dict, value) samples.
+    The file is written atomically.
+    """
+    summary = stage_summary(db, last_runs)
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP daily_motivation_{name} {help_text}")
+        lines.append(f"# TYPE daily_motivation_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"daily_motivation_{name}{{{label_text}}} {value}")
+
+    wall_samples = []
+    for stage, stats in summary.items():
+        wall_samples.append(({"stage": stage, "quantile": "0.5"}, stats["wall_p50"]))
+        wall_samples.append(({"stage": stage, "quantile": "0.95"}, stats["wall_p95"]))
+    metric("stage_wall_seconds", "summary", f"Stage wall time over the last {last_runs} runs", wall_samples)
+    lines.extend(
+        f'daily_motivation_stage_wall_seconds_sum{{stage="{stage}"}} {stats["wall_sum"]}' for stage, stats in summary.items()
+    )
+    lines.extend(
+        f'daily_motivation_stage_wall_seconds_count{{stage="{stage}"}} {stats["count"]}' for stage, stats in summary.items()
+    )
+
+    metric("stage_cpu_seconds_p95", "gauge", "95th percentile stage CPU time",
+           [({"stage": stage}, stats["cpu_p95"]) for stage, stats in summary.items()])
+    metric("stage_peak_rss_kilobytes", "gauge", "Peak RSS (process and children) sampled during the stage",
+           [({"stage": stage}, stats["peak_rss_kb"]) for stage, stats in summary.items()])
+    metric("stage_bytes", "gauge", "Bytes processed by the stage",
+           [({"stage": stage}, stats["bytes"]) for stage, stats in summary.items()])
+    metric("stage_errors", "gauge", "Failed stage spans",
+           [({"stage": stage}, stats["errors"]) for stage, stats in summary.items()])
+
+    for name, samples in (extra_gauges or {}).items():
+        metric(name, "gauge", name.replace("_", " "), samples)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+def export_metrics(db, extra_gauges=None):
+    """Export to the textfile named by METRICS_TEXTFILE, if set"""
+    path = os.getenv("METRICS_TEXTFILE")
+    if path:
+        export_prometheus(db, path, extra_gauges=extra_gauges)
+
+def print_summary(db, last_runs=20):
+    """Print p50/p95 stage timings over the last runs"""
+    summary = stage_summary(db, last_runs)
+
+    print(f"\n=== STAGE TIMINGS (last {last_runs} runs) ===")
+    print(f"{'stage':<22}{'count':>6}{'wall p50':>10}{'wall p95':>10}{'cpu p50':>10}{'cpu p95':>10}{'peak RSS':>11}{'bytes':>12}")
+    for stage, stats in sorted(summary.items(), key=lambda item: item[1]["wall_sum"], reverse=True):
+        print(
+            f"{stage:<22}{stats['count']:>6}"
+            f"{stats['wall_p50']:>9.2f}s{stats['wall_p95']:>9.2f}s"
+            f"{stats['cpu_p50']:>9.2f}s{stats['cpu_p95']:>9.2f}s"
+            f"{stats['peak_rss_kb'] / 1024:>9.0f}MB"
+            f"{stats['bytes'] / 1e6:>10.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Summarize recorded stage timings")
+    parser.add_argument("--last", type=int, default=20, help="number of most recent runs to summarize")
+    parser.add_argument("--export", help="also write a Prometheus textfile to this path")
+    args = parser.parse_args()
+
+    db = Database()
+    print_summary(db, args.last)
+    if args.export:
+        export_prometheus(db, args.export, args.last)
@@ -1,40 +1,150 @@
+import hashlib
 import json
-import yt_dlp
 import os
 import whisper
 import openai
 import subprocess
+import time
 import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-
-from text_matching import find_robust_timestamps
-from poster import XPoster
+from yt_dlp.utils import download_range_func
+
+from downloader import DownloadManager
+from database import Database
+from metrics import export_metrics, finish_run, span, start_run
+from media import (
+    SMART_CUT_VERSION, TWITTER_FORMAT, ensure_twitter_compatible, get_keyframes, probe_video_stream, smart_cut_video,
+    snap_to_keyframe,
+)
+from text_matching import MATCHER_VERSION, find_robust_timestamps
+from poster import XPoster, shared_rate_limiter
 
 load_dotenv()
 
-def download_video(video_url, video_directory):
+# Bump a stage's version when its logic changes. Its cached artifacts, and those of every
+# stage downstream of it, are then recomputed on the next run.
+STAGE_VERSIONS = {
+    "transcription": 1,
+    "narratives": 1,
+    "snippet_timestamps": 1,
+    "snippets": 1,
+}
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _import_legacy_file(db, stage, key, legacy_file, from_legacy=None):
+    """
+    Store a stage's pre-artifact-store JSON cache file as its artifact; returns it.
+
+    The file is renamed to <file>.imported, so it is imported only once and never
+    stands in for a later run with different inputs.
+    """
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        artifact = json.load(f)
+    if from_legacy is not None:
+        artifact = from_legacy(artifact)
+
+    db.put_artifact(stage, key, artifact)
+    os.replace(legacy_file, f"{legacy_file}.imported")
+    print(f"📦 Imported {legacy_file} as stored {stage}")
+    return artifact
+
+def run_stage(db, stage, inputs, compute, is_valid=None, legacy_file=None, from_legacy=None):
+    """
+    Run a pipeline stage, reusing its stored artifact when nothing it depends on changed.
+
+    Artifacts are keyed by the stage version and a hash of its inputs. Passing an
+    upstream stage's key as an input makes the stage depend on it, so changing an
+    upstream stage invalidates only the stages that depend on it. is_valid can reject a
+    stored artifact (e.g. its output files are gone). Returns (result, key); a result
+    of None is not stored.
+
+    legacy_file is the JSON file the stage used to be cached in; if there is no stored
+    artifact yet, it is imported (through from_legacy) instead of recomputing the stage.
+    """
+    key = _digest(stage, STAGE_VERSIONS[stage], inputs)
+
+    artifact = db.get_artifact(stage, key)
+    if artifact is None and legacy_file and os.path.exists(legacy_file):
+        artifact = _import_legacy_file(db, stage, key, legacy_file, from_legacy)
+    if artifact is not None and (is_valid is None or is_valid(artifact)):
+        print(f"♻️  Reusing stored {stage}")
+        return artifact, key
+
+    with span(stage):
+        result = compute()
+    if result is not None:
+        db.put_artifact(stage, key, result)
+
+    return result, key
+
+def download_video(video_url, video_directory, download_manager=None):
+    download_manager = download_manager or DownloadManager()
     ydl_opts = {
         'outtmpl': f'{video_directory}/%(title)s.%(ext)s',
+        # Prefer native H.264/AAC streams; anything else is transcoded after probing
+        'format': TWITTER_FORMAT,
         'merge_output_format': 'mp4',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }],
-        'postprocessor_args': {
-            'ffmpeg': ['-c:v', 'libx264', '-c:a', 'aac', '-preset', 'medium']
-        }
     }
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        download_result = ydl.extract_info(video_url, download=True)
-        actual_filename = ydl.prepare_filename(download_result)
+    # Only transcode if the download violates X's upload constraints
+    video_path, _ = download_manager.download(
+        video_url, ydl_opts, key=f"{video_url}#video", postprocess=ensure_twitter_compatible
+    )
+    return video_path
+
+def download_audio(video_url, video_directory, download_manager=None):
+    """Download only the audio track, which is all transcription and narrative extraction need"""
+    download_manager = download_manager or DownloadManager()
+    ydl_opts = {
+        'outtmpl': f'{video_directory}/%(title)s.audio.%(ext)s',
+        'format': 'bestaudio[ext=m4a]/bestaudio',
+    }
+
+    audio_path, _ = download_manager.download(video_url, ydl_opts, key=f"{video_url}#audio")
+    return audio_path
+
+def download_video_ranges(video_url, video_directory, snippet_timestamps, padding=2.0, download_manager=None):
+    """
+    Download only the time ranges of the selected snippets (plus padding on each side).
+
+    Each range is saved as its own section file, cut exactly at the padded start so that
+    snippet times map onto it by a fixed offset. Returns copies of the snippets with
+    'source_file' and 'source_offset' set for extract_video_snippets.
+    """
+    download_manager = download_manager or DownloadManager()
+    ranged_snippets = []
+
+    for snippet in snippet_timestamps:
+        section_start = max(0, snippet['start_time'] - padding)
+        section_end = snippet['end_time'] + padding
+
+        ydl_opts = {
+            'outtmpl': f'{video_directory}/%(id)s.{int(section_start * 1000)}-{int(section_end * 1000)}.%(ext)s',
+            'format': TWITTER_FORMAT,
+            'merge_output_format': 'mp4',
+            'download_ranges': download_range_func(None, [(section_start, section_end)]),
+            # Re-encode the (short) section edges so it starts exactly at section_start
+            'force_keyframes_at_cuts': True,
+        }
+
+        print(f"Downloading range {section_start:.1f}s - {section_end:.1f}s for: {snippet['title']}")
+
+        actual_filename, _ = download_manager.download(
+            video_url, ydl_opts, key=f"{video_url}#{section_start:.3f}-{section_end:.3f}"
+        )
 
-        if not os.path.exists(actual_filename):
-            raise Exception(f"Download failed - file not found: {actual_filename}")
+        ranged_snippets.append({
+            **snippet,
+            'source_file': actual_filename,
+            'source_offset': section_start,
+        })
 
-        return actual_filename
+    return ranged_snippets
 
-def transcribe_video(video_path, model_size="base", transcription_file=None):
+def transcribe_video(video_path, model_size="base"):
     """
     Transcribe video with different model sizes and progress indication.
 
@@ -47,43 +157,17 @@ def transcribe_video(video_path, model_size="base", transcription_file=None):
             - "medium": Even better accuracy (~2x realtime)
             - "large": Best accuracy, slowest (~1x realtime)
     """
-    # check if transcription file exists
-    if os.path.exists(transcription_file):
-        with open(transcription_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-
     print(f"Loading Whisper model '{model_size}'...")
     model = whisper.load_model(model_size)
 
     print(f"Transcribing video: {os.path.basename(video_path)}")
     print("This may take a few minutes depending on video length...")
 
-    result = model.transcribe(video_path, word_timestamps=True, verbose=True)
-
-    if transcription_file:
-        with open(transcription_file, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2)
-
-        print(f"Transcription saved to {transcription_file}")
+    return model.transcribe(video_path, word_timestamps=True, verbose=True)
 
-    return result
-
-def extract_narratives(video_transcription, narratives_file=None):
-    """Uses OpenAI's GPT models to find powerful narrative snippets in the transcript."""
-    print("\nConnecting to OpenAI API to find powerful narratives...")
-
-    # check if narratives file exists
-    if os.path.exists(narratives_file):
-        with open(narratives_file, "r", encoding="utf-8") as f:
-            return json.load(f)
-
-    try:
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    except Exception as e:
-        print(f"Failed to initialize OpenAI client. Is the API key set correctly? Error: {e}")
-        return None
+NARRATIVES_MODEL = "gpt-4.1"
 
-    system_prompt = """
+NARRATIVES_SYSTEM_PROMPT = """
     You are an expert content strategist specializing in extracting powerful, resonant content from interviews and podcasts with successful people.
 
     Your goal is to identify 5-10 distinct themes or ideas that will deeply resonate with audiences seeking inspiration, growth, and success insights.
@@ -155,14 +239,24 @@ def extract_narratives(video_transcription, narratives_file=None):
     Focus on extracting wisdom that transcends the speaker's specific industry or circumstances - universal insights that apply to anyone pursuing success, growth, or fulfillment.
     """
 
+def extract_narratives(video_transcription):
+    """Uses OpenAI's GPT models to find powerful narrative snippets in the transcript."""
+    print("\nConnecting to OpenAI API to find powerful narratives...")
+
+    try:
+        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    except Exception as e:
+        print(f"Failed to initialize OpenAI client. Is the API key set correctly? Error: {e}")
+        return None
+
     user_prompt = f"Analyze this interview/podcast transcript and extract the most resonant themes that will inspire and help people: --- {video_transcription['text']} ---"
 
     try:
         response = client.chat.completions.create(
-            model="gpt-4.1",
+            model=NARRATIVES_MODEL,
             response_format={"type": "json_object"},
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": NARRATIVES_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
             temperature=0.7
@@ -173,10 +267,6 @@ def extract_narratives(video_transcription, narratives_file=None):
 
         print("Successfully received and parsed narratives from OpenAI.")
 
-        if narratives_file:
-            with open(narratives_file, "w", encoding="utf-8") as f:
-                json.dump(narratives.get('snippets', []), f, indent=2)
-
         return narratives.get('snippets', [])
 
     except openai.APIError as e:
@@ -189,12 +279,7 @@ def extract_narratives(video_transcription, narratives_file=None):
 
     return None
 
-def extract_snippet_timestamps(video_transcription, narratives, snippet_timestamps_file=None):
-    # check if snippet timestamps file exists
-    if os.path.exists(snippet_timestamps_file):
-        with open(snippet_timestamps_file, 'r') as f:
-            return json.load(f)
-
+def extract_snippet_timestamps(video_transcription, narratives):
     snippet_timestamps = []
 
     for narrative in narratives:
@@ -216,10 +301,6 @@ def extract_snippet_timestamps(video_transcription, narratives, snippet_timestam
                 "summary": narrative["summary"]
             })
 
-    if snippet_timestamps_file:
-        with open(snippet_timestamps_file, 'w') as f:
-            json.dump(snippet_timestamps, f, indent=2)
-
     return snippet_timestamps
 
 def cleanup_snippet_timestamps(snippet_timestamps):
@@ -237,95 +318,280 @@ def cleanup_snippet_timestamps(snippet_timestamps):
 
     return cleaned_snippet_timestamps
 
-def extract_video_snippets(video_path, snippet_timestamps, snippets_metadata_file):
-    """Extract video snippets using ffmpeg based on timestamps"""
+def _snippet_output_file(snippet, output_folder):
+    # Create safe filename
+    safe_title = "".join(c for c in snippet['title'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    safe_title = safe_title.replace(' ', '_')[:50]
 
-    output_folder = "extracted_snippets"
-
-    if os.path.exists(snippets_metadata_file):
-        with open(snippets_metadata_file, 'r') as f:
-            extracted_files = json.load(f)
-        return extracted_files
-
-    os.makedirs(output_folder, exist_ok=True)
+    return os.path.join(output_folder, f"{safe_title}.mp4")
 
-    extracted_files = []
-
-    for i, snippet in enumerate(snippet_timestamps, 1):
-        print(f"\n📹 Processing snippet {i}/{len(snippet_timestamps)}: {snippet['title']}")
-
-        # Create safe filename
-        safe_title = "".join(c for c in snippet['title'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        safe_title = safe_title.replace(' ', '_')[:50]
+def _extract_snippet(video_path, snippet, output_file, ffmpeg_threads, keyframes_by_source=None, snap_tolerance=0,
+                     streams_by_source=None):
+    """
+    Cut a single snippet with ffmpeg, limited to ffmpeg_threads encoder threads.
 
-        output_file = os.path.join(output_folder, f"{safe_title}.mp4")
+    If the snippet carries a 'source_file' (a downloaded section), it is cut from that
+    file, shifting its times by 'source_offset'.
 
-        # Calculate duration
-        duration = snippet['end_time'] - snippet['start_time']
+    When keyframes are given, the snippet is smart-cut (only the partial GOPs at the
+    edges are re-encoded, matching the source stream from streams_by_source) and its
+    cut points may be snapped to a keyframe within snap_tolerance seconds. Otherwise,
+    or if the smart cut fails, the whole snippet is re-encoded.
+    """
+    video_path = snippet.get('source_file', video_path)
+    source_offset = snippet.get('source_offset', 0)
+
+    # Cut points are relative to the source file, which may be a downloaded section
+    start_time = snippet['start_time'] - source_offset
+    end_time = snippet['end_time'] - source_offset
+
+    keyframes = (keyframes_by_source or {}).get(video_path)
+
+    smart_cut_done = False
+    if keyframes:
+        start_time = snap_to_keyframe(start_time, keyframes, snap_tolerance)
+        end_time = snap_to_keyframe(end_time, keyframes, snap_tolerance)
+        smart_cut_done = smart_cut_video(
+            video_path, start_time, end_time, output_file, keyframes,
+            stream=(streams_by_source or {}).get(video_path), threads=ffmpeg_threads,
+        )
 
-        if os.path.exists(output_file):
-            print(f"✗ Skipping {snippet['title']} because it already exists")
-            continue
+    duration = end_time - start_time
 
+    if not smart_cut_done:
         # FFmpeg command for accurate cutting
         cmd = [
             'ffmpeg',
-            '-ss', str(snippet['start_time']),
+            '-ss', str(start_time),
             '-i', video_path,
             '-t', str(duration),
             '-c:v', 'libx264',
             '-c:a', 'aac',
             '-preset', 'fast',
             '-crf', '23',
+            '-threads', str(ffmpeg_threads),
             '-avoid_negative_ts', 'make_zero',
             '-y',
             output_file
         ]
 
-        print(f"Extracting: {snippet['title']} ({snippet['start_time']:.1f}s - {snippet['end_time']:.1f}s)")
+        subprocess.run(cmd, check=True, capture_output=True)
 
-        try:
-            subprocess.run(cmd, check=True, capture_output=True)
-            print(f"✓ Saved to: {output_file}")
+    return {
+        'title': snippet['title'],
+        'theme': snippet['theme'],
+        'summary': snippet['summary'],
+        'start_time': start_time + source_offset,
+        'end_time': end_time + source_offset,
+        'duration': duration,
+        'file': output_file
+    }
 
-            extracted_files.append({
-                'title': snippet['title'],
-                'theme': snippet['theme'],
-                'summary': snippet['summary'],
-                'start_time': snippet['start_time'],
-                'end_time': snippet['end_time'],
-                'duration': duration,
-                'file': output_file
-            })
+def extract_video_snippets(video_path, snippet_timestamps, max_workers=None, thread_budget=None,
+                           smart_cut=False, snap_tolerance=0):
+    """
+    Extract video snippets using ffmpeg based on timestamps.
+
+    Snippets are cut by a bounded pool of concurrent ffmpeg jobs. The pool shares a
+    global thread budget (defaults to the CPU count), so max_workers x -threads never
+    oversubscribes the machine. A failing snippet is reported and skipped without
+    affecting the others, and the metadata file keeps the input snippet order.
 
-        except subprocess.CalledProcessError as e:
-            print(f"✗ Error extracting {snippet['title']}: {e}")
+    With smart_cut, each source's keyframes are indexed (cached next to the video) and
+    its video stream is probed once, and each snippet stream-copies its whole GOPs,
+    re-encoding only the edges. Cut points within snap_tolerance seconds of a keyframe
+    are snapped to it, which skips the edge re-encode entirely.
 
-    # Save metadata
-    with open(snippets_metadata_file, 'w') as f:
-        json.dump(extracted_files, f, indent=2)
+    Snippets produced by download_video_ranges are cut from their own section files,
+    in which case video_path may be None.
+    """
+
+    output_folder = "extracted_snippets"
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    thread_budget = thread_budget or os.cpu_count() or 1
+    # Each libx264 job scales well up to a few threads, so prefer more jobs with fewer threads
+    max_workers = max(1, min(max_workers or max(1, thread_budget // 2), thread_budget))
+    ffmpeg_threads = max(1, thread_budget // max_workers)
+
+    keyframes_by_source = {}
+    streams_by_source = {}
+    if smart_cut:
+        for source in dict.fromkeys(snippet.get('source_file', video_path) for snippet in snippet_timestamps):
+            try:
+                keyframes_by_source[source] = get_keyframes(source)
+                streams_by_source[source] = probe_video_stream(source)
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                print(f"✗ Could not index keyframes for {source}, falling back to full re-encode: {e}")
+
+    jobs = [
+        (i, snippet, _snippet_output_file(snippet, output_folder))
+        for i, snippet in enumerate(snippet_timestamps)
+    ]
+
+    print(f"\n📹 Extracting {len(jobs)} snippets with {max_workers} workers x {ffmpeg_threads} ffmpeg threads")
+
+    results = [None] * len(snippet_timestamps)
+    completed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for i, snippet, output_file in jobs:
+            print(f"Extracting: {snippet['title']} ({snippet['start_time']:.1f}s - {snippet['end_time']:.1f}s)")
+            futures[executor.submit(
+                _extract_snippet, video_path, snippet, output_file, ffmpeg_threads, keyframes_by_source, snap_tolerance,
+                streams_by_source
+            )] = (i, snippet, output_file)
+
+        for future in as_completed(futures):
+            i, snippet, output_file = futures[future]
+            completed += 1
+
+            try:
+                results[i] = future.result()
+                print(f"✓ [{completed}/{len(jobs)}] Saved to: {output_file}")
+            except subprocess.CalledProcessError as e:
+                print(f"✗ [{completed}/{len(jobs)}] Error extracting {snippet['title']}: {e}")
+            except Exception as e:
+                print(f"✗ [{completed}/{len(jobs)}] Unexpected error extracting {snippet['title']}: {e}")
+
+    extracted_files = [result for result in results if result is not None]
 
     print(f"\n✅ Extraction complete! {len(extracted_files)} snippets extracted to: {output_folder}")
-    print(f"📄 Metadata saved to: {snippets_metadata_file}")
 
     return extracted_files
 
-def post_video_snippets(snippets_metadata, video_url, video_speaker_x_handle, community_id=None):
+def upload_video_snippets(poster, snippets, max_workers=3, media_ids=None, on_uploaded=None):
+    """
+    Upload snippets concurrently, then wait for X to process all of them together.
+
+    media_ids can hold still-valid media ids from an earlier run (None for snippets that
+    need uploading); on_uploaded(index, media) is called as each upload finishes.
+    Returns the media ids in the order of the snippets.
+    """
+    media_ids = list(media_ids or [None] * len(snippets))
+    processing = [media_id for media_id in media_ids if media_id]
+    pending = [i for i, media_id in enumerate(media_ids) if not media_id]
+
+    if processing:
+        print(f"\n♻️  Reusing {len(processing)} uploaded snippets")
+
+    if pending:
+        print(f"\n⬆️  Uploading {len(pending)} snippets with {max_workers} workers...")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(poster.upload_video, snippets[i]['file']): i for i in pending}
+
+            for future in as_completed(futures):
+                i = futures[future]
+                media = future.result()
+                media_ids[i] = media.media_id
+                if on_uploaded:
+                    on_uploaded(i, media)
+                if media.processing_info is not None:
+                    processing.append(media.media_id)
+                print(f"✅ Uploaded snippet {i + 1}/{len(snippets)}: {snippets[i]['title']}")
+
+    # one poller for every media id, so the thread only starts once all media is ready
+    if processing:
+        with span("media_processing"):
+            poster.wait_for_media_batch(processing)
+
+    return media_ids
+
+def _snippet_hash(snippet):
+    """Identifies a snippet across runs, whatever position it ends up in"""
+    return _digest(snippet['title'], snippet['start_time'], snippet['end_time'])
+
+def _checkpoint_matches(row, expected_hash, file=None):
+    """Whether a thread_posts row was recorded for the snippet (or source reply) expected at its position"""
+    if row.get("snippet_hash") is not None:
+        return row["snippet_hash"] == expected_hash
+    # recorded before snippet hashes, only the file can be compared
+    return row.get("file") == file
+
+def post_video_snippets(snippets_metadata, video_url, video_speaker_x_handle, community_id=None, upload_workers=3,
+                        db=None, resume=True):
+    """
+    Post the snippets as a thread, ending with a reply linking the source video.
+
+    With a Database, every uploaded media id and posted tweet is checkpointed in
+    thread_posts as it happens, together with a hash of its snippet. When resume is on,
+    a re-run continues the thread after its last posted tweet and reuses unexpired
+    uploads instead of starting over. If the snippets changed since the posted part of
+    the thread, the checkpoint no longer describes this thread and it is posted from
+    scratch.
+    """
     poster = XPoster(community_id=community_id)
     previous_post_id = None
 
-    for snippet in snippets_metadata:
-        # skip if the duration is less than 60 seconds
-        if snippet['duration'] < 60:
+    # skip if the duration is less than 60 seconds
+    snippets = [snippet for snippet in snippets_metadata if snippet['duration'] >= 60]
+
+    thread_key = video_url
+    snippet_hashes = [_snippet_hash(snippet) for snippet in snippets]
+    source_position = len(snippets)
+    source_hash = _digest("source", video_url)
+
+    checkpoint = {}
+    if db is not None and resume:
+        checkpoint = db.get_thread_posts(thread_key)
+
+        # uploads recorded for other snippets can't be reused
+        for i, row in list(checkpoint.items()):
+            expected_hash = snippet_hashes[i] if i < source_position else source_hash
+            file = snippets[i]['file'] if i < source_position else None
+            if i > source_position or not _checkpoint_matches(row, expected_hash, file):
+                if row.get("tweet_id"):
+                    print("\n⚠️  Snippets changed since this thread was last posted, posting it from scratch")
+                    checkpoint = {}
+                    break
+                del checkpoint[i]
+
+    if db is not None and not checkpoint:
+        db.clear_thread_posts(thread_key)
+
+    def on_uploaded(i, media):
+        if db is not None:
+            expires_at = time.time() + media.expires_after_secs if media.expires_after_secs else None
+            db.save_thread_post(thread_key, i, file=snippets[i]['file'], media_id=str(media.media_id),
+                                media_expires_at=expires_at, snippet_hash=snippet_hashes[i])
+
+    posted = [i for i in range(len(snippets)) if checkpoint.get(i, {}).get("tweet_id")]
+    unposted = [i for i in range(len(snippets)) if i not in posted]
+    if posted:
+        print(f"\n♻️  Resuming thread after {len(posted)} posted snippets")
+
+    # media uploaded by an earlier run that is still valid isn't uploaded again
+    media_ids = [None] * len(snippets)
+    for i in unposted:
+        saved = checkpoint.get(i, {})
+        if saved.get("file") == snippets[i]['file'] and (saved.get("media_expires_at") or 0) > time.time() + 600:
+            media_ids[i] = saved["media_id"]
+
+    # upload everything up front, then publish the thread in order
+    uploaded = upload_video_snippets(
+        poster,
+        [snippets[i] for i in unposted],
+        max_workers=upload_workers,
+        media_ids=[media_ids[i] for i in unposted],
+        on_uploaded=lambda j, media: on_uploaded(unposted[j], media),
+    )
+    for i, media_id in zip(unposted, uploaded):
+        media_ids[i] = media_id
+
+    for i, (snippet, media_id) in enumerate(zip(snippets, media_ids)):
+        tweet_id = checkpoint.get(i, {}).get("tweet_id")
+        if tweet_id:
+            previous_post_id = tweet_id
             continue
 
         text = f"{snippet['title']}\n\n{snippet['summary']}"
-        media = poster.api.media_upload(snippet['file'], chunked=True, media_category="amplify_video")
-        media_id = media.media_id
+        parent_id = previous_post_id
 
         if previous_post_id:
             # Post as reply to previous tweet
-            post = poster.client.create_tweet(
+            post = poster.create_tweet(
                 text=text,
                 media_ids=[media_id],
                 in_reply_to_tweet_id=previous_post_id
@@ -341,53 +607,148 @@ def post_video_snippets(snippets_metadata, video_url, video_speaker_x_handle, co
                 post_id = poster._post_to_community(full_text, media_id, post_reply=False)
                 previous_post_id = post_id
             else:
-                post = poster.client.create_tweet(
+                post = poster.create_tweet(
                     text=full_text,
                     media_ids=[media_id]
                 )
                 previous_post_id = post.data["id"]
 
+        if db is not None:
+            db.save_thread_post(thread_key, i, file=snippet['file'], media_id=str(media_id),
+                                tweet_id=str(previous_post_id), parent_id=parent_id, snippet_hash=snippet_hashes[i])
+
     # Add source video link as final reply
-    poster.client.create_tweet(
+    if checkpoint.get(source_position, {}).get("tweet_id"):
+        print("Thread already posted")
+        return
+
+    post = poster.create_tweet(
         text=f"Source: {video_url}",
         in_reply_to_tweet_id=previous_post_id
     )
+    if db is not None:
+        db.save_thread_post(thread_key, source_position, tweet_id=str(post.data["id"]), parent_id=previous_post_id,
+                            snippet_hash=source_hash)
 
-if __name__ == "__main__":
-    with open("config.yaml", "r") as f:
-        config = yaml.safe_load(f)
-
+def run_long_form(config, db=None):
+    """Turn the video in config (see config.yaml.copy) into a thread of snippets; returns False if it stopped early"""
     video_url = config["video_url"]
     video_speaker_x_handle = config["video_speaker_x_handle"]
     community_id = config.get("community_id")
+    model_size = config.get("whisper_model", "base")
 
     # Setup files and directories
     video_id = video_url.split("v=")[1]
     video_directory = f"videos/{video_id}"
     os.makedirs(video_directory, exist_ok=True)
 
-    transcription_file = f"{video_directory}/transcription.json"
-    narratives_file = f"{video_directory}/narratives.json"
-    snippet_timestamps_file = f"{video_directory}/snippet_timestamps.json"
-    snippets_metadata_file = f"{video_directory}/snippets_metadata.json"
+    # Stage artifacts (transcription, narratives, timestamps, snippets) are stored in the database
+    db = db or Database()
 
-    # download video
-    video_path = download_video(video_url, video_directory)
+    # time every stage of this run (see `python metrics.py`)
+    start_run(db, "longform")
+    run_status = "error"
 
-    # transcribe video
-    video_transcription = transcribe_video(video_path, transcription_file=transcription_file)
+    try:
+        # "full" downloads the whole video up front; "audio_first" downloads the audio for
+        # transcription and later fetches only the selected snippet ranges
+        download_mode = config.get("download_mode", "full")
+        download_manager = DownloadManager(db=db)
+
+        with span("download") as download_span:
+            if download_mode == "audio_first":
+                video_path = None
+                media_path = download_audio(video_url, video_directory, download_manager=download_manager)
+            else:
+                video_path = download_video(video_url, video_directory, download_manager=download_manager)
+                media_path = video_path
+            download_span["bytes"] = os.path.getsize(media_path)
+
+        # transcribe video
+        video_transcription, transcription_key = run_stage(
+            db, "transcription",
+            {"video_url": video_url, "model_size": model_size},
+            lambda: transcribe_video(media_path, model_size),
+            legacy_file=f"{video_directory}/transcription.json",
+        )
 
-    # extract narratives
-    narratives = extract_narratives(video_transcription, narratives_file=narratives_file)
+        # extract narratives
+        narratives, narratives_key = run_stage(
+            db, "narratives",
+            {"transcription": transcription_key, "model": NARRATIVES_MODEL, "prompt": _digest(NARRATIVES_SYSTEM_PROMPT)},
+            lambda: extract_narratives(video_transcription),
+            legacy_file=f"{video_directory}/narratives.json",
+        )
+        if narratives is None:
+            print("ERROR: Could not extract narratives.")
+            return False
+
+        # extract snippet timestamps, cleaned up to not have intersecting timestamps
+        snippet_timestamps, snippet_timestamps_key = run_stage(
+            db, "snippet_timestamps",
+            {"transcription": transcription_key, "narratives": narratives_key, "matcher": MATCHER_VERSION},
+            lambda: cleanup_snippet_timestamps(extract_snippet_timestamps(video_transcription, narratives)),
+            # the old cache file was written before cleanup
+            legacy_file=f"{video_directory}/snippet_timestamps.json",
+            from_legacy=cleanup_snippet_timestamps,
+        )
+
+        def extract_snippets():
+            snippets = snippet_timestamps
+
+            # download only the snippet ranges
+            if download_mode == "audio_first":
+                snippets = download_video_ranges(
+                    video_url,
+                    video_directory,
+                    snippets,
+                    padding=config.get("range_padding", 2.0),
+                    download_manager=download_manager,
+                )
+
+            return extract_video_snippets(
+                video_path,
+                snippets,
+                max_workers=config.get("extract_workers"),
+                thread_budget=config.get("ffmpeg_thread_budget"),
+                smart_cut=config.get("smart_cut", False),
+                snap_tolerance=config.get("keyframe_snap_tolerance", 0),
+            )
 
-    # extract snippet timestamps
-    snippet_timestamps = extract_snippet_timestamps(video_transcription, narratives, snippet_timestamps_file=snippet_timestamps_file)
+        # extract video snippets
+        snippets_metadata, _ = run_stage(
+            db, "snippets",
+            {
+                "snippet_timestamps": snippet_timestamps_key,
+                "download_mode": download_mode,
+                "range_padding": config.get("range_padding", 2.0),
+                "smart_cut": config.get("smart_cut", False) and SMART_CUT_VERSION,
+                "snap_tolerance": config.get("keyframe_snap_tolerance", 0),
+            },
+            extract_snippets,
+            is_valid=lambda snippets: all(os.path.exists(snippet["file"]) for snippet in snippets),
+            legacy_file=f"{video_directory}/snippets_metadata.json",
+        )
+
+        # post video snippets
+        with span("post_thread"):
+            post_video_snippets(
+                snippets_metadata, video_url, video_speaker_x_handle, community_id,
+                upload_workers=config.get("upload_workers", 3),
+                db=db,
+                resume=config.get("resume_thread", True),
+            )
 
-    # cleanup snippets to not have intersecting timestamps
-    snippet_timestamps = cleanup_snippet_timestamps(snippet_timestamps)
+        run_status = "ok"
+        return True
+    finally:
+        finish_run(run_status)
+        export_metrics(db, shared_rate_limiter.gauges())
 
-    # extract video snippets
-    snippets_metadata = extract_video_snippets(video_path, snippet_timestamps, snippets_metadata_file=snippets_metadata_file)
+if __name__ == "__main__":
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
 
-    # post video snippets
-    post_video_snippets(snippets_metadata, video_url, video_speaker_x_handle, community_id)
+    if not run_long_form(config):
+        print("Exiting.")
+        exit(1)
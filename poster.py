@@ -1,25 +1,45 @@
 import os
-import tweepy
 import requests
 import json
+import mimetypes
+import asyncio
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, as_completed, wait
+from urllib.parse import urlparse
 from requests_oauthlib import OAuth1
-import openai
-import whisper
+
+from media import encode_for_upload
+from metrics import span
+
+
+class PostCancelled(Exception):
+    """Raised by one half of a concurrent post when the other half failed"""
+
+# Result of a finished chunked upload
+UploadedMedia = namedtuple("UploadedMedia", ["media_id", "expires_after_secs", "processing_info"])
 
 class InspiringPostGenerator:
     def __init__(self, openai_api_key=None, whisper_model_size="base"):
         self.openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
         self.whisper_model_size = whisper_model_size
         self._whisper_model = None
+        # one transcription at a time on the shared model (posting and prefetching)
+        self._whisper_lock = threading.Lock()
 
     def transcribe(self, video_path):
-        if self._whisper_model is None:
-            self._whisper_model = whisper.load_model(self.whisper_model_size)
-        result = self._whisper_model.transcribe(video_path)
+        with span("transcribe", bytes_processed=os.path.getsize(video_path)), self._whisper_lock:
+            if self._whisper_model is None:
+                # imported on first use, it pulls in torch
+                import whisper
+                self._whisper_model = whisper.load_model(self.whisper_model_size)
+            result = self._whisper_model.transcribe(video_path)
         return result["text"]
 
     def generate_post(self, transcript, video_title):
+        import openai
+
         openai.api_key = self.openai_api_key
         prompt = f"""
 You are a world-class motivational storyteller and social media expert.
@@ -34,23 +54,381 @@ Given the following transcript from a motivational video titled `{video_title}`,
 Transcript:
 """
         prompt += transcript + "\n\nSocial media post:"
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a world-class motivational storyteller and social media expert."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=512,
-            temperature=0.9,
-        )
-        return response.choices[0].message.content.strip()
+        with span("caption"):
+            response = openai.chat.completions.create(
+                model="gpt-4",
+                messages=[
+                    {"role": "system", "content": "You are a world-class motivational storyteller and social media expert."},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=512,
+                temperature=0.9,
+            )
+        text = response.choices[0].message.content.strip()
+        # Remove leading and trailing double quotes if present
+        if text.startswith('"') and text.endswith('"'):
+            text = text[1:-1].strip()
+        return text
 
     def generate_inspiring_post_from_video(self, video_path, video_title):
         transcript = self.transcribe(video_path)
         return self.generate_post(transcript, video_title)
 
+class RateLimiter:
+    """
+    Client-side, per-endpoint rate-limit budgets learned from X's x-rate-limit-* headers.
+
+    Callers wait for (or, from async code, acquire) an endpoint before calling it. While
+    its budget has calls left one is reserved; once it is used up the caller waits until
+    the window resets. Only the waiting caller is held up, so other threads
+    (transcription, encoding) and other endpoints keep going. Endpoints without a known budget are not limited.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._budgets = {}  # endpoint -> {"limit", "remaining", "reset"}
+
+    def _reserve(self, endpoint):
+        """Reserve a call to endpoint; returns 0, or the seconds to wait before trying again"""
+        with self._lock:
+            budget = self._budgets.get(endpoint)
+            now = time.time()
+
+            # unknown endpoint or a window that has reset; the next response refreshes the budget
+            if budget is None or budget["reset"] <= now:
+                return 0
+
+            if budget["remaining"] > 0:
+                budget["remaining"] -= 1
+                return 0
+
+            return budget["reset"] - now + 1
+
+    def wait(self, endpoint):
+        """Block the calling thread until a call to endpoint fits in its budget"""
+        while True:
+            delay = self._reserve(endpoint)
+            if not delay:
+                return
+            print(f"Rate limit for {endpoint} used up, waiting {delay:.0f}s...")
+            time.sleep(delay)
+
+    async def acquire(self, endpoint):
+        """Wait without blocking the event loop until a call to endpoint fits in its budget"""
+        while True:
+            delay = self._reserve(endpoint)
+            if not delay:
+                return
+            print(f"Rate limit for {endpoint} used up, waiting {delay:.0f}s...")
+            await asyncio.sleep(delay)
+
+    def update(self, endpoint, headers):
+        """
+        Refresh an endpoint's budget from a response's rate-limit headers.
+
+        Within the same window the lower of the local and the server's remaining count is
+        kept, so calls reserved by other threads that X hasn't counted yet aren't handed
+        out again. Headers of an older window (a late response) are ignored.
+        """
+        try:
+            budget = {
+                "limit": int(headers["x-rate-limit-limit"]),
+                "remaining": int(headers["x-rate-limit-remaining"]),
+                "reset": float(headers["x-rate-limit-reset"]),
+            }
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with self._lock:
+            current = self._budgets.get(endpoint)
+            if current is not None:
+                if budget["reset"] < current["reset"]:
+                    return
+                if budget["reset"] == current["reset"]:
+                    budget["remaining"] = min(budget["remaining"], current["remaining"])
+            self._budgets[endpoint] = budget
+
+    def state(self):
+        """Current budgets as {endpoint: {"limit", "remaining", "reset"}}"""
+        with self._lock:
+            return {endpoint: dict(budget) for endpoint, budget in self._budgets.items()}
+
+    def gauges(self):
+        """Current budgets as extra gauges for metrics.export_metrics"""
+        state = self.state()
+        return {
+            "rate_limit_remaining": [({"endpoint": endpoint}, budget["remaining"]) for endpoint, budget in state.items()],
+            "rate_limit_limit": [({"endpoint": endpoint}, budget["limit"]) for endpoint, budget in state.items()],
+            "rate_limit_reset_seconds": [
+                ({"endpoint": endpoint}, max(0, budget["reset"] - time.time())) for endpoint, budget in state.items()
+            ],
+        }
+
+# Rate limits belong to the account, so every XPoster in the process shares one limiter
+shared_rate_limiter = RateLimiter()
+
+# Tweet creation, for XPoster.create_tweet and the community posts
+TWEETS_URL = "https://api.twitter.com/2/tweets"
+
+# Result of XPoster.create_tweet, shaped like the tweepy Response it replaces (post.data["id"])
+TweetResponse = namedtuple("TweetResponse", ["data"])
+
+class XTransport:
+    """
+    Shared HTTP transport for raw X API calls.
+
+    One pooled requests.Session keeps connections to the API alive across calls, and a
+    single OAuth 1.0a signer signs every request. Idempotent calls (GET, and calls made
+    with idempotent=True such as APPEND segments) are retried with exponential backoff on
+    429, 5xx and connection errors. Other POSTs may already have taken effect when the
+    response is lost or a 5xx comes back, so they are only retried when the request was
+    never sent (connect timeout) or was rejected with a 429. When X says when to come
+    back (Retry-After or x-rate-limit-reset), that time is waited for instead.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+    def __init__(self, api_key, api_secret, access_token, access_token_secret, max_retries=3,
+                 backoff_secs=2, max_wait_secs=900, timeout=60, pool_size=16, rate_limiter=None):
+        self.rate_limiter = rate_limiter or shared_rate_limiter
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_secs = backoff_secs
+        self.max_wait_secs = max_wait_secs
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+        # Use OAuth 1.0a authentication instead of Bearer token (required for community posting)
+        self.session.auth = OAuth1(
+            api_key,
+            client_secret=api_secret,
+            resource_owner_key=access_token,
+            resource_owner_secret=access_token_secret,
+        )
+
+    def _retry_delay(self, response, attempt):
+        """Seconds to wait before retrying, from the response headers or exponential backoff"""
+        headers = response.headers if response is not None else {}
+
+        if headers.get("retry-after", "").isdigit():
+            delay = float(headers["retry-after"])
+        elif response is not None and response.status_code == 429 and headers.get("x-rate-limit-reset"):
+            delay = float(headers["x-rate-limit-reset"]) - time.time() + 1
+        else:
+            delay = self.backoff_secs * 2 ** attempt
+
+        return min(max(delay, 0), self.max_wait_secs)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        """
+        Send a signed request, retrying rate-limited and failed attempts; returns the last response.
+
+        idempotent defaults to True for GET-like methods and False for POST.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = f"{method} {urlparse(url).path}"
+        if idempotent is None:
+            idempotent = method in self.IDEMPOTENT_METHODS
+
+        # a non-idempotent request that may have reached X must not be sent twice
+        retry_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout) if idempotent \
+            else (requests.exceptions.ConnectTimeout,)
+        retry_statuses = self.RETRY_STATUSES if idempotent else (429,)
+
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait(endpoint)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except retry_errors as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(None, attempt)
+                print(f"X API {method} {url} failed ({e}), retrying in {delay:.0f}s...")
+                time.sleep(delay)
+                continue
+
+            self.rate_limiter.update(endpoint, response.headers)
+
+            if response.status_code not in retry_statuses or attempt == self.max_retries:
+                return response
+
+            delay = self._retry_delay(response, attempt)
+            print(f"X API {method} {url} returned {response.status_code}, retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+class ChunkedUploader:
+    """
+    Chunked media uploads (INIT, APPEND, FINALIZE) with concurrent APPEND segments.
+
+    Segments are sent by a bounded pool of workers, and a failed segment is retried on
+    its own instead of restarting the upload. Progress is kept in a sidecar JSON next to
+    the file (<file>.upload.json), so an interrupted upload resumes with the same media
+    id and only sends the missing segments, as long as the file is unchanged and the
+    media id hasn't expired.
+
+    Concurrent uploads (e.g. all snippets of a thread) share one cap on segments in
+    flight, sized to the transport's connection pool minus reserved_connections for
+    INIT, STATUS, FINALIZE and tweets, so every request reuses a kept-alive connection.
+    """
+
+    UPLOAD_URL = "https://upload.twitter.com/1.1/media/upload.json"
+
+    def __init__(self, transport, segment_size=4 * 1024 * 1024, max_workers=4, segment_retries=2,
+                 reserved_connections=4):
+        self.transport = transport
+        self.segment_size = segment_size
+        self.max_workers = max_workers
+        self.segment_retries = segment_retries
+        self._state_lock = threading.Lock()
+
+        # segments in flight across all uploads, at most the pooled connections left for them
+        pool_size = getattr(transport, "pool_size", max_workers + reserved_connections)
+        self._segment_slots = threading.Semaphore(max(1, pool_size - reserved_connections))
+
+    def _call(self, data, files=None, idempotent=False):
+        response = self.transport.post(self.UPLOAD_URL, data=data, files=files, idempotent=idempotent)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def _state_path(self, path):
+        return f"{path}.upload.json"
+
+    def _load_state(self, path):
+        """The sidecar state of an unfinished upload of this exact file, or None"""
+        try:
+            with open(self._state_path(path), "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        stat = os.stat(path)
+        if (state.get("size") != stat.st_size or state.get("mtime") != stat.st_mtime
+                or state.get("segment_size") != self.segment_size
+                or state.get("expires_at", 0) < time.time() + 600):
+            return None
+        return state
+
+    def _save_state(self, path, state):
+        with self._state_lock:
+            tmp_path = self._state_path(path) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self._state_path(path))
+
+    def _clear_state(self, path):
+        if os.path.exists(self._state_path(path)):
+            os.remove(self._state_path(path))
+
+    def _append(self, path, state, index, cancel_event=None):
+        """Send one segment, retrying it on failure; returns its size"""
+        with open(path, "rb") as f:
+            f.seek(index * self.segment_size)
+            chunk = f.read(self.segment_size)
+
+        for attempt in range(self.segment_retries + 1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise PostCancelled(f"Upload of {path} cancelled")
+
+            try:
+                with self._segment_slots:
+                    self._call(
+                        {"command": "APPEND", "media_id": state["media_id"], "segment_index": index},
+                        files={"media": chunk},
+                        # re-sending a segment index replaces it, so APPEND is safe to retry
+                        idempotent=True,
+                    )
+                break
+            except Exception as e:
+                if attempt == self.segment_retries:
+                    raise
+                print(f"Segment {index} failed ({e}), retrying...")
+
+        with self._state_lock:
+            state["done"].append(index)
+        self._save_state(path, state)
+        return len(chunk)
+
+    def upload(self, path, media_category="amplify_video", cancel_event=None):
+        """Upload a file, resuming an unfinished upload of it; returns UploadedMedia"""
+        size = os.path.getsize(path)
+        segments = max(1, -(-size // self.segment_size))
+
+        state = self._load_state(path)
+        if state:
+            print(f"Resuming upload of media {state['media_id']} ({len(state['done'])}/{segments} segments sent)")
+        else:
+            media_type = mimetypes.guess_type(path)[0] or "video/mp4"
+            result = self._call({
+                "command": "INIT",
+                "total_bytes": size,
+                "media_type": media_type,
+                "media_category": media_category,
+            })
+            stat = os.stat(path)
+            state = {
+                "media_id": result["media_id_string"],
+                "size": size,
+                "mtime": stat.st_mtime,
+                "segment_size": self.segment_size,
+                "expires_at": time.time() + result.get("expires_after_secs", 86400),
+                "done": [],
+            }
+            self._save_state(path, state)
+
+        pending = [index for index in range(segments) if index not in state["done"]]
+        started = time.perf_counter()
+        sent = 0
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, max(1, len(pending)))) as executor:
+            futures = [executor.submit(self._append, path, state, index, cancel_event) for index in pending]
+            try:
+                for future in as_completed(futures):
+                    sent += future.result()
+            except Exception as e:
+                for future in futures:
+                    future.cancel()
+                if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code < 500:
+                    # X rejected the media id itself, start over next time
+                    self._clear_state(path)
+                raise
+
+        elapsed = time.perf_counter() - started
+        if sent:
+            print(f"Uploaded {sent / 1e6:.1f}MB in {elapsed:.1f}s ({sent / 1e6 / max(elapsed, 1e-6):.2f}MB/s)")
+
+        try:
+            result = self._call({"command": "FINALIZE", "media_id": state["media_id"]})
+        except requests.exceptions.HTTPError:
+            # the segments X kept don't add up to the file, start over next time
+            self._clear_state(path)
+            raise
+        self._clear_state(path)
+
+        return UploadedMedia(
+            result.get("media_id_string", state["media_id"]),
+            result.get("expires_after_secs"),
+            result.get("processing_info"),
+        )
+
+    def status(self, media_id):
+        """Get the processing status of an uploaded media id"""
+        response = self.transport.get(self.UPLOAD_URL, params={"command": "STATUS", "media_id": media_id})
+        response.raise_for_status()
+        return response.json()
+
 class XPoster:
-    def __init__(self, community_id=None, db=None, post_generator=None):
+    def __init__(self, community_id=None, db=None, post_generator=None, upload_profile=True, transport=None,
+                 rate_limiter=None):
         # Twitter API credentials
         self.api_key = os.getenv("TWITTER_API_KEY")
         self.api_secret = os.getenv("TWITTER_API_SECRET")
@@ -64,31 +442,64 @@ class XPoster:
         # Database instance for caching media_ids
         self.db = db
 
-        # Initialize Twitter API v2
-        self.client = tweepy.Client(
-            bearer_token=self.bearer_token,
-            consumer_key=self.api_key,
-            consumer_secret=self.api_secret,
-            access_token=self.access_token,
-            access_token_secret=self.access_token_secret,
+        # Per-endpoint rate-limit budgets shared by tweets, uploads and raw v2 calls
+        self.rate_limiter = rate_limiter or shared_rate_limiter
+
+        # Keep-alive session with retries for the raw v2 calls
+        self.transport = transport or XTransport(
+            self.api_key, self.api_secret, self.access_token, self.access_token_secret,
+            rate_limiter=self.rate_limiter,
         )
 
-        # Initialize Twitter API v1
-        auth = tweepy.OAuthHandler(self.api_key, self.api_secret)
-        auth.set_access_token(self.access_token, self.access_token_secret)
-        self.api = tweepy.API(auth, wait_on_rate_limit=True)
+        # Concurrent, resumable chunked uploads over the same transport
+        self.uploader = ChunkedUploader(self.transport)
 
         self.post_generator = post_generator or InspiringPostGenerator()
 
-    def wait_for_media_processing(self, media_id):
-        """Wait for Twitter to finish processing the uploaded media"""
+        # Encode videos to a size-targeted profile before uploading them
+        self.upload_profile = upload_profile
+
+    def create_tweet(self, text, media_ids=None, in_reply_to_tweet_id=None):
+        """
+        Create a tweet through the transport, like client.create_tweet.
+
+        Every response (not only a 429) refreshes the tweets endpoint's rate-limit budget,
+        so posting slows down before the budget runs out instead of after.
+        """
+        payload = {"text": text}
+        if media_ids:
+            payload["media"] = {"media_ids": [str(media_id) for media_id in media_ids]}
+        if in_reply_to_tweet_id:
+            payload["reply"] = {"in_reply_to_tweet_id": str(in_reply_to_tweet_id)}
+
+        response = self.transport.post(TWEETS_URL, json=payload)
+        response.raise_for_status()
+        return TweetResponse(response.json()["data"])
+
+    def upload_video(self, video_path, cancel_event=None):
+        """Upload a video with the chunked media endpoint, encoding it to the upload profile first"""
+        if self.upload_profile:
+            try:
+                with span("upload_encode", bytes_processed=os.path.getsize(video_path)):
+                    video_path = encode_for_upload(video_path)
+            except Exception as e:
+                print(f"Warning: Upload encode failed, uploading the original file: {e}")
+
+        with span("upload", bytes_processed=os.path.getsize(video_path)):
+            return self.uploader.upload(video_path, media_category="amplify_video", cancel_event=cancel_event)
+
+    def wait_for_media_processing(self, media_id, cancel_event=None):
+        """Wait for Twitter to finish processing the uploaded media, giving up early if cancel_event is set"""
         print(f"Waiting for media {media_id} to finish processing...")
 
         max_attempts = 60  # Maximum wait time of ~60 seconds
         for attempt in range(max_attempts):
+            if cancel_event is not None and cancel_event.is_set():
+                raise PostCancelled(f"Stopped waiting for media {media_id}")
+
             try:
-                result = self.api.get_media_upload_status(media_id)
-                processing_info = result.processing_info
+                result = self.uploader.status(media_id)
+                processing_info = result['processing_info']
 
                 state = processing_info.get('state', 'succeeded')
 
@@ -105,8 +516,11 @@ class XPoster:
                     # Still processing
                     check_after_secs = processing_info.get('check_after_secs', 1)
                     print(f"Processing... (state: {state}, check again in {check_after_secs}s)")
-                    time.sleep(check_after_secs)
-            except Exception as e:
+                    if cancel_event is not None:
+                        cancel_event.wait(check_after_secs)
+                    else:
+                        time.sleep(check_after_secs)
+            except KeyError as e:
                 if "processing_info" in str(e).lower():
                     # If no processing_info, assume it's done
                     print("No processing info available - assuming media is ready")
@@ -116,54 +530,151 @@ class XPoster:
 
         raise Exception("Media processing timeout - took too long to process")
 
-    def post(self, video_path, video_title, video_url, video_id=None):
-        try:
-            # Always upload video fresh since media_ids expire quickly
-            print("Uploading video...")
-            media = self.api.media_upload(video_path, chunked=True, media_category="amplify_video")
-            media_id = media.media_id
-
-            # Wait for video processing to complete
-            self.wait_for_media_processing(media_id)
-
-            # Use AI to generate an inspiring post
-            print("Generating inspiring post text using AI...")
-            text = self.post_generator.generate_inspiring_post_from_video(video_path, video_title)
-            # Remove leading and trailing double quotes if present
-            if text.startswith('"') and text.endswith('"'):
-                text = text[1:-1].strip()
-            print(f"Generated post: {text}")
+    def wait_for_media_batch(self, media_ids, cancel_event=None, timeout_secs=600):
+        """
+        Wait until X has processed all of the given media ids, with one poller for all of them.
 
-            # Use direct API call for community posting
-            if self.community_id:
-                print(f"Posting to Twitter Community ID: {self.community_id}")
-                post_id = self._post_to_community(text, media_id, video_url)
-                return post_id
-            else:
-                print("Posting as regular tweet")
-                post = self.client.create_tweet(text=text, media_ids=[media_id])
+        Each media id is polled when its check_after_secs has passed, so a slow video doesn't
+        hold up the checks of the others. Raises if any media fails processing.
+        """
+        next_check = {media_id: 0 for media_id in media_ids}
+        deadline = time.time() + timeout_secs
+        print(f"Waiting for {len(next_check)} media to finish processing...")
 
-                # add comment with video link
-                self.client.create_tweet(
-                    text=f"Video source: {video_url}",
-                    in_reply_to_tweet_id=post.data["id"]
-                )
-                return post.data["id"]
+        while next_check:
+            if cancel_event is not None and cancel_event.is_set():
+                raise PostCancelled("Stopped waiting for media processing")
+            if time.time() > deadline:
+                raise Exception(f"Media processing timeout - {len(next_check)} media still processing")
+
+            now = time.time()
+            for media_id in [media_id for media_id, check_at in next_check.items() if check_at <= now]:
+                processing_info = self.uploader.status(media_id).get('processing_info')
+                state = processing_info.get('state', 'succeeded') if processing_info else 'succeeded'
+
+                if state == 'succeeded':
+                    print(f"Media {media_id} processing complete!")
+                    del next_check[media_id]
+                elif state == 'failed':
+                    error = processing_info.get('error', {})
+                    raise Exception(
+                        f"Media {media_id} processing failed: {error.get('name', 'Unknown error')} - "
+                        f"{error.get('message', 'No error message')}"
+                    )
+                else:
+                    next_check[media_id] = time.time() + processing_info.get('check_after_secs', 1)
+
+            if next_check:
+                delay = max(0, min(next_check.values()) - time.time())
+                if cancel_event is not None:
+                    cancel_event.wait(delay)
+                else:
+                    time.sleep(delay)
+
+        return True
+
+    def _upload_and_process(self, video_path, video_id, cancel_event):
+        """Upload a video, wait until X has processed it and remember its media id; returns the media id"""
+        print("Uploading video...")
+        media = self.upload_video(video_path, cancel_event)
+        media_id = media.media_id
+        uploaded_at = time.time()
+
+        # Wait for video processing to complete
+        if media.processing_info is not None:
+            with span("media_processing"):
+                self.wait_for_media_processing(media_id, cancel_event)
+
+        # media ids expire expires_after_secs after FINALIZE
+        expires_after_secs = getattr(media, "expires_after_secs", None)
+        if self.db and video_id and expires_after_secs:
+            self.db.update_video_media_id(video_id, str(media_id), uploaded_at + expires_after_secs)
+
+        return media_id
+
+    def _generate_caption(self, video_path, video_title, cancel_event):
+        """Use AI to generate an inspiring post, skipping the GPT call if the upload already failed"""
+        print("Generating inspiring post text using AI...")
+        transcript = self.post_generator.transcribe(video_path)
+        if cancel_event.is_set():
+            raise PostCancelled("Upload failed, skipping caption generation")
+
+        text = self.post_generator.generate_post(transcript, video_title)
+        print(f"Generated post: {text}")
+        return text
+
+    def post(self, video_path, video_title, video_url, video_id=None, caption=None, before_tweet=None):
+        """
+        Upload a video and post it with an AI-generated caption.
+
+        The network-bound upload and processing wait run concurrently with the CPU-bound
+        transcription and caption generation. If either fails, the other is told to stop
+        at its next checkpoint and the error is raised. A caption prepared in advance
+        (see prefetch.py) is used as is. before_tweet is called right before tweeting, e.g.
+        to renew the claim on the video; if it raises, nothing is tweeted.
+        """
+        # reuse the media uploaded by an earlier attempt while it hasn't expired
+        media_id = self.db.get_video_media_id(video_id) if self.db and video_id else None
+        reused_media = media_id is not None
+        tweeting = False
+
+        try:
+            if reused_media:
+                print(f"Reusing uploaded media {media_id}")
+            if caption:
+                print(f"Using prepared post: {caption}")
+
+            cancel_event = threading.Event()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = []
+                if not caption:
+                    caption_future = executor.submit(self._generate_caption, video_path, video_title, cancel_event)
+                    futures.append(caption_future)
+                if not reused_media:
+                    media_future = executor.submit(self._upload_and_process, video_path, video_id, cancel_event)
+                    futures.append(media_future)
+
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                failed = [future for future in done if future.exception()]
+                if failed:
+                    # stop the other half, then raise the original error
+                    cancel_event.set()
+                    raise failed[0].exception()
+
+                if not reused_media:
+                    media_id = media_future.result()
+                text = caption or caption_future.result()
+
+            if before_tweet:
+                before_tweet()
+
+            tweeting = True
+            with span("tweet"):
+                # Use direct API call for community posting
+                if self.community_id:
+                    print(f"Posting to Twitter Community ID: {self.community_id}")
+                    post_id = self._post_to_community(text, media_id, video_url)
+                    return post_id
+                else:
+                    print("Posting as regular tweet")
+                    post = self.create_tweet(text=text, media_ids=[media_id])
+
+                    # add comment with video link
+                    self.create_tweet(
+                        text=f"Video source: {video_url}",
+                        in_reply_to_tweet_id=post.data["id"]
+                    )
+                    return post.data["id"]
         except Exception as e:
             print(f"Error posting video: {e}")
+            if reused_media and tweeting:
+                # the reused media may be what X rejected, upload fresh on the next attempt
+                self.db.update_video_media_id(video_id, None)
             raise e
 
     def _post_to_community(self, text, media_id, post_reply=False, video_url=None):
         """Post directly to Twitter Community using X API v2 with OAuth 1.0a"""
-        url = "https://api.twitter.com/2/tweets"
-
-        # Use OAuth 1.0a authentication instead of Bearer token for community posting
-        auth = OAuth1(
-            self.api_key,
-            client_secret=self.api_secret,
-            resource_owner_key=self.access_token,
-            resource_owner_secret=self.access_token_secret,
-        )
+        url = TWEETS_URL
 
         payload = {
             "text": text,
@@ -176,7 +687,7 @@ class XPoster:
         print(f"Attempting community post with payload: {json.dumps(payload, indent=2)}")
 
         try:
-            response = requests.post(url, json=payload, auth=auth)
+            response = self.transport.post(url, json=payload)
 
             print(f"Response status: {response.status_code}")
             print(f"Response text: {response.text}")
@@ -214,10 +725,10 @@ class XPoster:
         print("Posting as regular tweet instead...")
 
         try:
-            post = self.client.create_tweet(text=text, media_ids=[str(media_id)])
+            post = self.create_tweet(text=text, media_ids=[str(media_id)])
 
             # add comment with video link
-            self.client.create_tweet(
+            self.create_tweet(
                 text=f"Video source: {video_url}",
                 in_reply_to_tweet_id=post.data["id"]
             )
@@ -230,15 +741,7 @@ class XPoster:
 
     def _post_reply(self, video_url, reply_to_id):
         """Post a reply with the video source URL"""
-        url = "https://api.twitter.com/2/tweets"
-
-        # Use OAuth 1.0a authentication for consistency with community posting
-        auth = OAuth1(
-            self.api_key,
-            client_secret=self.api_secret,
-            resource_owner_key=self.access_token,
-            resource_owner_secret=self.access_token_secret,
-        )
+        url = TWEETS_URL
 
         payload = {
             "text": f"Video source: {video_url}",
@@ -248,7 +751,7 @@ class XPoster:
         }
 
         try:
-            response = requests.post(url, json=payload, auth=auth)
+            response = self.transport.post(url, json=payload)
             response.raise_for_status()
             result = response.json()
             print(f"Successfully posted source URL reply: {result['data']['id']}")
@@ -261,14 +764,20 @@ class XPoster:
         try:
             # Note: This requires Twitter API v2 with appropriate permissions
             # You might need elevated access for this endpoint
-            response = self.client.get_owned_lists()
-            if response.data:
+            response = self.transport.get("https://api.twitter.com/2/users/me")
+            response.raise_for_status()
+            user_id = response.json()["data"]["id"]
+
+            response = self.transport.get(f"https://api.twitter.com/2/users/{user_id}/owned_lists")
+            response.raise_for_status()
+            communities = response.json().get("data") or []
+            if communities:
                 print("Available communities/lists:")
-                for community in response.data:
-                    print(f"  ID: {community.id} - Name: {community.name}")
+                for community in communities:
+                    print(f"  ID: {community['id']} - Name: {community['name']}")
             else:
                 print("No communities found or insufficient permissions")
-            return response.data if response.data else []
+            return communities
         except Exception as e:
             print(f"Error fetching communities: {e}")
             print("Note: Community access might require elevated Twitter API permissions")
@@ -284,7 +793,7 @@ class XPoster:
                 return post_id
             else:
                 print("Posting as regular tweet")
-                post = self.client.create_tweet(text=text)
+                post = self.create_tweet(text=text)
                 return post.data["id"]
         except Exception as e:
             print(f"Error posting text: {e}")
@@ -292,15 +801,7 @@ class XPoster:
 
     def _post_text_to_community(self, text):
         """Post text directly to Twitter Community using X API v2 with OAuth 1.0a"""
-        url = "https://api.twitter.com/2/tweets"
-
-        # Use OAuth 1.0a authentication instead of Bearer token for community posting
-        auth = OAuth1(
-            self.api_key,
-            client_secret=self.api_secret,
-            resource_owner_key=self.access_token,
-            resource_owner_secret=self.access_token_secret,
-        )
+        url = TWEETS_URL
 
         payload = {
             "text": text,
@@ -310,7 +811,7 @@ class XPoster:
         print(f"Attempting community text post with payload: {json.dumps(payload, indent=2)}")
 
         try:
-            response = requests.post(url, json=payload, auth=auth)
+            response = self.transport.post(url, json=payload)
 
             print(f"Response status: {response.status_code}")
             print(f"Response text: {response.text}")
@@ -344,7 +845,7 @@ class XPoster:
         print("Posting as regular tweet instead...")
 
         try:
-            post = self.client.create_tweet(text=text)
+            post = self.create_tweet(text=text)
             print(f"Successfully posted as regular tweet: {post.data['id']}")
             return post.data["id"]
         except Exception as e:
@@ -0,0 +1,156 @@
+import os
+import random
+import threading
+from dotenv import load_dotenv
+
+from database import Database
+from media import encode_for_upload
+from metrics import finish_run, span, start_run
+
+load_dotenv()
+
+
+class Prefetcher:
+    """
+    Keep a buffer of videos that are ready to post.
+
+    A prepared video is downloaded and X-compatible, has its upload encode in
+    upload_cache/ and its caption (from the transcript) stored in the Database. It is
+    also moved up the queue, so posting it is just upload + tweet. When there is
+    nothing left to prepare, new videos are harvested, spread across the people from
+    successful.txt with the fewest videos in the queue. Running in the background, the
+    prefetcher thread lowers its own CPU priority so posting isn't slowed down.
+    """
+
+    def __init__(self, db, target=3, post_generator=None, interval_secs=10 * 60, niceness=10):
+        self.db = db
+        self.target = target
+        self.post_generator = post_generator
+        self.interval_secs = interval_secs
+        self.niceness = niceness
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _post_generator(self):
+        if self.post_generator is None:
+            from poster import InspiringPostGenerator
+            self.post_generator = InspiringPostGenerator()
+        return self.post_generator
+
+    def next_person(self):
+        """A person from successful.txt with the fewest unposted videos"""
+        from main import get_successful_people
+
+        queued = self.db.count_queued_by_person()
+        people = get_successful_people()
+        fewest = min(queued.get(person, 0) for person in people)
+        return random.choice([person for person in people if queued.get(person, 0) == fewest])
+
+    def harvest(self):
+        """Download one new video into the queue; returns False if none was found"""
+        from main import Video
+
+        successful_person = self.next_person()
+        print(f"📥 Prefetching a new video of {successful_person}")
+        return Video(successful_person, self.db).get_videos() is not None
+
+    def prepare(self, video):
+        """Make the upload encode and store the caption of a downloaded video"""
+        print(f"🧰 Preparing {video['id']}: {video['title']}")
+        file_path = video["filepath"]
+
+        with span("prefetch_encode", bytes_processed=os.path.getsize(file_path)):
+            # cached in upload_cache/, XPoster.upload_video picks it up from there
+            encode_for_upload(file_path)
+
+        post_generator = self._post_generator()
+        transcript = post_generator.transcribe(file_path)
+        caption = post_generator.generate_post(transcript, video["title"])
+
+        self.db.set_video_caption(video["id"], caption)
+        print(f"✅ Prepared {video['id']}: {caption}")
+
+    def fill(self):
+        """
+        Prepare videos until target of them are ready to post; returns how many were prepared.
+
+        Stage timings are recorded as a "prefetch" run of this thread's own, so they don't
+        land in a post that runs meanwhile. A video that fails to prepare is counted against
+        it (see Database.get_videos_to_prepare) and the next one is tried.
+        """
+        prepared = 0
+        if self._stop.is_set() or self.db.count_prepared() >= self.target:
+            return prepared
+
+        start_run(self.db, "prefetch", thread_only=True)
+        run_status = "error"
+
+        # videos that failed to prepare during this fill, so the next candidate is tried instead
+        failed = set()
+
+        try:
+            while not self._stop.is_set() and self.db.count_prepared() < self.target:
+                videos = [
+                    video for video in self.db.get_videos_to_prepare(limit=len(failed) + 1)
+                    if video["id"] not in failed
+                ]
+                if not videos:
+                    # don't keep harvesting when every new video fails to prepare
+                    if len(failed) >= self.target or not self.harvest():
+                        break
+                    continue
+
+                video = videos[0]
+                if not video["filepath"] or not os.path.exists(video["filepath"]):
+                    print(f"WARNING: File missing for {video['id']}, forgetting it")
+                    self.db.clear_video_filepath(video["id"])
+                    continue
+
+                try:
+                    self.prepare(video)
+                    prepared += 1
+                except Exception as e:
+                    print(f"ERROR: Could not prepare {video['id']}: {e}")
+                    self.db.record_prepare_failure(video["id"])
+                    failed.add(video["id"])
+
+            run_status = "ok"
+            return prepared
+        finally:
+            finish_run(run_status)
+
+    def _run(self):
+        # niceness of this thread only (Linux), inherited by the ffmpeg it starts
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.niceness)
+        except (AttributeError, OSError):
+            pass
+
+        while not self._stop.is_set():
+            try:
+                self.fill()
+            except Exception as e:
+                print(f"ERROR: Prefetch failed: {e}")
+            self._stop.wait(self.interval_secs)
+
+    def start(self):
+        """Keep the buffer filled from a background thread"""
+        self._thread = threading.Thread(target=self._run, name="prefetcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop after the video being prepared"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+def prefetch_target():
+    """Number of ready-to-post videos to keep, from PREFETCH_TARGET (0 disables prefetching)"""
+    return int(os.getenv("PREFETCH_TARGET", "0"))
+
+
+if __name__ == "__main__":
+    # fill the buffer once, e.g. from cron between posts
+    Prefetcher(Database(), target=prefetch_target() or 3).fill()
@@ -0,0 +1,162 @@
+import os
+import time
+from dotenv import load_dotenv
+
+from media import file_hash
+
+load_dotenv()
+
+
+class StorageManager:
+    """
+    Keep the media directories under a size quota using Database state.
+
+    Only files that are safe to lose are evicted: downloads of videos that have already
+    been posted (their Database filepath is cleared), snippets whose thread tweets have
+    all been posted (from thread_posts), the long-form source downloads in videos/<id>/
+    of fully posted threads (their stages are stored as artifacts and a re-run downloads
+    them again) and re-creatable upload encodes from upload_cache/. Files of unposted queue items and unposted snippets are never touched,
+    and neither are the upload encodes of claimed or prepared videos or encodes used in
+    the last min_cache_age_secs (e.g. by an upload that is still running).
+    Eviction is least-recently-used first, by the file's last access or modification
+    time. Sizes are in decimal MB (1e6 bytes), like the rest of the project's output.
+    """
+
+    def __init__(self, db, quota_bytes, directories=("videos", "extracted_snippets"), cache_dir="upload_cache",
+                 min_cache_age_secs=60 * 60):
+        self.db = db
+        self.quota_bytes = quota_bytes
+        self.directories = directories
+        self.cache_dir = cache_dir
+        self.min_cache_age_secs = min_cache_age_secs
+
+    def _directory_size(self, directory):
+        total = 0
+        for root, _, files in os.walk(directory):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def usage(self):
+        """Total bytes used by the managed directories"""
+        return sum(self._directory_size(directory) for directory in (*self.directories, self.cache_dir))
+
+    def _in_use_hashes(self):
+        """Content hashes of the claimed and prepared videos, whose upload encodes must be kept"""
+        hashes = set()
+        for filepath in self.db.get_in_use_video_files():
+            try:
+                hashes.add(file_hash(filepath))
+            except OSError:
+                pass
+        return hashes
+
+    def evictable_files(self):
+        """List (last_used, size, path, video_id) of evictable files, least recently used first"""
+        candidates = []
+
+        for video_id, filepath in self.db.get_posted_video_files():
+            if filepath and os.path.exists(filepath):
+                stat = os.stat(filepath)
+                candidates.append((max(stat.st_atime, stat.st_mtime), stat.st_size, filepath, video_id))
+
+        # extracted snippets can be cut again if the thread is ever re-run
+        for filepath in self.db.get_posted_snippet_files():
+            if os.path.exists(filepath):
+                stat = os.stat(filepath)
+                candidates.append((max(stat.st_atime, stat.st_mtime), stat.st_size, filepath, None))
+
+        # full, audio and section downloads of long-form videos whose thread is posted
+        for thread_key in self.db.get_posted_thread_keys():
+            if "v=" not in thread_key:
+                continue
+            # same directory as post_long_form_video.run_long_form
+            directory = os.path.join("videos", thread_key.split("v=")[1])
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path) and not path.endswith(".keyframes.json"):
+                    stat = os.stat(path)
+                    candidates.append((max(stat.st_atime, stat.st_mtime), stat.st_size, path, None))
+
+        if os.path.isdir(self.cache_dir):
+            # upload encodes are named after their source's hash, see media.encode_for_upload
+            in_use = self._in_use_hashes()
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if not os.path.isfile(path) or name.split("-", 1)[0] in in_use:
+                    continue
+                stat = os.stat(path)
+                last_used = max(stat.st_atime, stat.st_mtime)
+                if last_used > time.time() - self.min_cache_age_secs:
+                    continue
+                candidates.append((last_used, stat.st_size, path, None))
+
+        candidates.sort()
+        return candidates
+
+    def report(self):
+        """Print and return current usage, the quota and how much space could be reclaimed"""
+        usage = self.usage()
+        evictable = self.evictable_files()
+        reclaimable = sum(size for _, size, _, _ in evictable)
+
+        print("\n=== STORAGE REPORT ===")
+        print(f"Usage: {usage / 1e6:.1f}MB / quota {self.quota_bytes / 1e6:.1f}MB")
+        print(f"Reclaimable: {reclaimable / 1e6:.1f}MB in {len(evictable)} files of posted videos, snippets, threads and upload cache")
+
+        return {
+            "usage_bytes": usage,
+            "quota_bytes": self.quota_bytes,
+            "reclaimable_bytes": reclaimable,
+            "evictable_files": len(evictable),
+        }
+
+    def enforce(self):
+        """Evict least recently used files until usage is under the quota; returns bytes freed"""
+        usage = self.usage()
+        freed = 0
+
+        if usage <= self.quota_bytes:
+            return freed
+
+        for _, size, path, video_id in self.evictable_files():
+            if usage - freed <= self.quota_bytes:
+                break
+
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Warning: Could not evict {path}: {e}")
+                continue
+
+            # keyframe index kept next to the video
+            if os.path.exists(f"{path}.keyframes.json"):
+                os.remove(f"{path}.keyframes.json")
+
+            if video_id:
+                self.db.clear_video_filepath(video_id)
+
+            freed += size
+            print(f"Evicted {path} ({size / 1e6:.1f}MB)")
+
+        if usage - freed > self.quota_bytes:
+            print(f"Warning: Still over quota after evicting {freed / 1e6:.1f}MB; remaining files belong to unposted videos, snippets and threads")
+
+        return freed
+
+
+def storage_quota_bytes():
+    """Storage quota from the VIDEO_STORAGE_QUOTA_MB environment variable (decimal MB), or None if unset"""
+    quota_mb = os.getenv("VIDEO_STORAGE_QUOTA_MB")
+    return int(float(quota_mb) * 1e6) if quota_mb else None
+
+
+if __name__ == "__main__":
+    from database import Database
+
+    StorageManager(Database(), storage_quota_bytes() or 0).report()
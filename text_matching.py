@@ -2,6 +2,11 @@ import re
 import difflib
 from fuzzywuzzy import fuzz
 
+from metrics import span
+
+# Bump when the matching logic changes, so cached snippet timestamps are recomputed
+MATCHER_VERSION = 1
+
 def normalize_text(text):
     """Normalize text for better matching"""
     # Convert to lowercase
@@ -246,28 +251,29 @@ def find_robust_timestamps(transcription_data, sentence_text, buffer_seconds=1):
     """
     Robust timestamp finding with multiple fallback methods
     """
-    print(f"\n🔍 Searching for: '{sentence_text[:50]}...'")
+    with span("text_matching"):
+        print(f"\n🔍 Searching for: '{sentence_text[:50]}...'")
 
-    # Try multiple methods
-    methods = ['fuzzy', 'sliding_window', 'sequence_match']
+        # Try multiple methods
+        methods = ['fuzzy', 'sliding_window', 'sequence_match']
 
-    for method in methods:
-        print(f"Trying {method} method...")
-        start_time, end_time = find_best_sentence_match(transcription_data, sentence_text, method)
+        for method in methods:
+            print(f"Trying {method} method...")
+            start_time, end_time = find_best_sentence_match(transcription_data, sentence_text, method)
 
-        if start_time is not None and end_time is not None:
-            # Add buffer
-            start_time = max(0, start_time - buffer_seconds)
-            end_time = end_time + buffer_seconds
+            if start_time is not None and end_time is not None:
+                # Add buffer
+                start_time = max(0, start_time - buffer_seconds)
+                end_time = end_time + buffer_seconds
 
-            print(f"✅ Found using {method}: {start_time:.2f}s - {end_time:.2f}s")
-            return start_time, end_time
-        else:
-            print(f"❌ {method} method failed")
+                print(f"✅ Found using {method}: {start_time:.2f}s - {end_time:.2f}s")
+                return start_time, end_time
+            else:
+                print(f"❌ {method} method failed")
 
-    # Last resort: try partial matching
-    print("Trying partial matching...")
-    return find_partial_match(transcription_data, sentence_text, buffer_seconds)
+        # Last resort: try partial matching
+        print("Trying partial matching...")
+        return find_partial_match(transcription_data, sentence_text, buffer_seconds)
 
 def find_partial_match(transcription_data, sentence_text, buffer_seconds=1):
     """Find partial matches by looking for key phrases"""